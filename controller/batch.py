@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, List, Optional, Tuple
+
+from fastapi import HTTPException
+from utils.profiling import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from models.chat_models import BatchQueryRequest
+from controller.chat import build_llm_messages, generate_answer, build_lean_response, save_chat_message
+from utils.llm_call import retrieve_segments_batch, MODEL_NAME
+from utils.room import create_room
+from utils.responses import dumps_line
+
+logger = logging.getLogger(__name__)
+
+BATCH_QUERY_MAX_PROMPTS = int(os.getenv("BATCH_QUERY_MAX_PROMPTS", "1000"))
+# LLM calls in flight at once for one batch; LM Studio serves few requests in parallel
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+
+def persist_exchange(user_prompt: str, answer: str, user_id: int) -> Optional[int]:
+    """Store one question/answer pair in a new room, like a first /room-query turn"""
+    room_id = create_room(user_prompt[:100], user_id)
+    if room_id is None:
+        return None
+    save_chat_message(room_id, user_prompt, type_user=True)
+    save_chat_message(room_id, answer, type_user=False)
+    return room_id
+
+
+async def retrieve_batch(request: BatchQueryRequest) -> Tuple[List[list], float]:
+    """RAG segments for every prompt, and the seconds retrieval took"""
+    started = time.perf_counter()
+    segments_per_prompt = await run_in_threadpool(
+        retrieve_segments_batch, request.prompts, request.top_k, request.similarity_threshold, request.filters
+    )
+    return segments_per_prompt, time.perf_counter() - started
+
+
+async def iter_batch_query(
+    request: BatchQueryRequest,
+    user_id: Optional[int] = None,
+    retrieved: Optional[Tuple[List[list], float]] = None
+) -> AsyncIterator[bytes]:
+    """Answer every prompt and yield one NDJSON line per result (in completion order), then a summary line.
+
+    `retrieved` is the result of retrieve_batch when retrieval already ran; otherwise it runs here.
+    """
+    started = time.perf_counter()
+    concurrency = max(1, min(request.concurrency or BATCH_LLM_CONCURRENCY, BATCH_LLM_CONCURRENCY))
+
+    segments_per_prompt, retrieval_seconds = retrieved or await retrieve_batch(request)
+    if retrieved:
+        started -= retrieval_seconds
+
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = 0
+
+    async def answer_one(index: int, user_prompt: str) -> dict:
+        top_segments = segments_per_prompt[index]
+        messages, packed_segments, (prompt_tokens, _, _) = build_llm_messages(user_prompt, [], top_segments)
+        async with semaphore:
+            llm_started = time.perf_counter()
+            answer, llm_prompt_tokens = await generate_answer(
+                messages, top_segments, request.temperature, request.max_tokens
+            )
+            llm_ms = round(1000 * (time.perf_counter() - llm_started), 1)
+        room_id = None
+        if request.persist and user_id is not None:
+            room_id = await run_in_threadpool(persist_exchange, user_prompt, answer, user_id)
+        metadata = {
+            "model": MODEL_NAME,
+            "segments_used": len(top_segments),
+            "segments_packed": len(packed_segments),
+            "prompt_tokens": llm_prompt_tokens if llm_prompt_tokens is not None else prompt_tokens,
+            "no_relevant_data": not bool(top_segments),
+            "llm_ms": llm_ms,
+            "chatroom_id": room_id,
+        }
+        return {"index": index, "prompt": user_prompt, **build_lean_response(answer, top_segments, metadata)}
+
+    tasks = [asyncio.ensure_future(answer_one(i, p)) for i, p in enumerate(request.prompts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                yield dumps_line(await next_done)
+            except Exception as e:
+                failed += 1
+                logger.error(f"❌ Batch item failed: {str(e)}")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    total_seconds = time.perf_counter() - started
+    yield dumps_line({"summary": {
+        "prompts": len(request.prompts),
+        "failed": failed,
+        "llm_concurrency": concurrency,
+        "retrieval_ms": round(1000 * retrieval_seconds, 1),
+        "total_seconds": round(total_seconds, 2),
+        "prompts_per_second": round(len(request.prompts) / total_seconds, 2) if total_seconds else None,
+        "persisted": request.persist and user_id is not None,
+    }})
+
+
+async def batch_query(request: BatchQueryRequest, current_user: dict) -> StreamingResponse:
+    if not request.prompts or any(not p or not p.strip() for p in request.prompts):
+        raise HTTPException(status_code=400, detail="⚠️ Empty query submitted ❗")
+    if len(request.prompts) > BATCH_QUERY_MAX_PROMPTS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_QUERY_MAX_PROMPTS} prompts per batch")
+    user_id = current_user.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="❌ User not authenticated 🔑")
+
+    # retrieval fails as a whole (DB down, model error): answer with an error status while we still can,
+    # instead of cutting off a stream whose 200 headers are already sent
+    try:
+        retrieved = await retrieve_batch(request)
+    except Exception as e:
+        logger.error(f"❌ Batch retrieval failed: {str(e)}")
+        raise HTTPException(status_code=503, detail="Retrieval failed, try again later")
+    return StreamingResponse(iter_batch_query(request, user_id, retrieved), media_type="application/x-ndjson")
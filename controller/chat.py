@@ -1,11 +1,14 @@
 import logging
 from models.chat_models import RoomPrompt, QueryResponse
 from fastapi import HTTPException, Depends
+from utils.profiling import run_in_threadpool
 from utils.user_verify import get_current_user, get_db_cursor
 from utils.llm_call import retrieve_segments, call_llm_api, MODEL_NAME
-from utils.room import create_room, verify_room_ownership
-from typing import Optional, List, Tuple, Dict, Any
+from utils.room import create_room, verify_room_ownership, PREVIOUS_MESSAGES_QUERY
+from utils.room_titles import enqueue_room_title
+from typing import Optional, List, Tuple, Dict, Any, Union
 import re
+import os
 import json
 
 # -----------------------------
@@ -15,6 +18,12 @@ CONTENT_TRUNCATION_LIMIT = 2500
 MIN_TRUNCATION_LIMIT = 500
 DEFAULT_NO_INFO_RESPONSE = "❌ Maglumat tapylmady."
 
+# Prompt packing: total token budget for system prompt + history + segments + question
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+HISTORY_BUDGET_RATIO = float(os.getenv("PROMPT_HISTORY_BUDGET_RATIO", "0.3"))
+CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3.5"))
+MIN_SEGMENT_TOKENS = 50
+
 logger = logging.getLogger(__name__)
 
 # -----------------------------
@@ -47,6 +56,48 @@ def smart_truncate_text(text: str, max_length: int = CONTENT_TRUNCATION_LIMIT) -
         return ' '.join(words[:-1]) + "..."
     return text[:max_length] + "..."
 
+def estimate_tokens(text: str) -> int:
+    """Fast token estimate; the LLM tokenizer is not available in-process"""
+    if not text:
+        return 0
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+def pack_history(previous_messages: List[dict], budget: int) -> Tuple[str, int]:
+    """Keep the most recent messages that fit into the token budget"""
+    lines = []
+    used = 0
+    for msg in reversed(previous_messages):
+        role = "👤 User" if msg['type_user'] else "🤖 Assistant"
+        line = f"{role}: {msg['prompt']}\n"
+        tokens = estimate_tokens(line)
+        if used + tokens > budget:
+            break
+        lines.append(line)
+        used += tokens
+    return "".join(reversed(lines)), used
+
+def pack_segments(segments: List[Tuple[str, str, float]], budget: int) -> Tuple[List[Tuple[str, str, float]], int]:
+    """Fit the best segments into the budget, dropping duplicates and trimming at sentence boundaries"""
+    packed = []
+    seen = set()
+    used = 0
+    for title, content, similarity in sorted(segments, key=lambda x: x[2], reverse=True):
+        fingerprint = " ".join(content.split()).lower()
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+
+        remaining = budget - used - estimate_tokens(f"{title}: \n")
+        if remaining < MIN_SEGMENT_TOKENS:
+            break
+        text = content
+        if estimate_tokens(text) > remaining:
+            text = smart_truncate_text(content, int(remaining * CHARS_PER_TOKEN))
+        tokens = estimate_tokens(f"{title}: {text}\n")
+        packed.append((title, text, similarity))
+        used += tokens
+    return packed, used
+
 def save_chat_message(room_id: int, prompt: str, type_user: bool) -> Optional[int]:
     try:
         with get_db_cursor() as cur:
@@ -124,16 +175,82 @@ async def process_room_setup(room_id: Optional[int], user_prompt: str, user_id:
         new_room_id = create_room(room_title, user_id)
         if new_room_id is None:
             raise HTTPException(status_code=500, detail="❌ Could not create chat room 🏚️")
+        # the truncated prompt is replaced by an LLM title in the background
+        enqueue_room_title(new_room_id, user_prompt)
         return new_room_id, room_title
     else:
         if not verify_room_ownership(room_id, user_id):
             raise HTTPException(status_code=403, detail="🚫 You do not have access to this room 🔒")
         return room_id, "Existing Room"
 
+def build_llm_messages(
+    user_prompt: str,
+    previous_messages: List[dict],
+    top_segments: List[Tuple[str, str, float]]
+) -> Tuple[List[dict], List[Tuple[str, str, float]], Tuple[int, int, int]]:
+    """Chat messages for the LLM, the packed segments and (prompt, history, segment) token estimates"""
+    system_prompt = create_system_prompt()
+    question_text = f"\n👤 User soragy: {user_prompt}\n\n📌 Relevant info:\n"
+    available = max(PROMPT_TOKEN_BUDGET - estimate_tokens(system_prompt) - estimate_tokens(question_text), 0)
+    context_text, history_tokens = pack_history(previous_messages, int(available * HISTORY_BUDGET_RATIO))
+    packed_segments, segment_tokens = pack_segments(top_segments, available - history_tokens)
+
+    user_message_content = f"{context_text}\n👤 User soragy: {user_prompt}"
+    if packed_segments:
+        context_segment_text = "\n".join([f"{title}: {content}" for title, content, _ in packed_segments])
+        user_message_content += f"\n\n📌 Relevant info:\n{context_segment_text}"
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message_content},
+    ]
+    prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_message_content)
+    return messages, packed_segments, (prompt_tokens, history_tokens, segment_tokens)
+
+async def generate_answer(
+    messages: List[dict],
+    top_segments: List[Tuple[str, str, float]],
+    temperature: float,
+    max_tokens: int
+) -> Tuple[str, Optional[int]]:
+    """LLM answer with the segment/general-knowledge fallback and Turkmen corrections applied"""
+    generated_answer = ""
+    llm_prompt_tokens = None
+    try:
+        response = await call_llm_api(messages, temperature, max_tokens)
+        if response and "choices" in response and response["choices"]:
+            generated_answer = response["choices"][0].get("message", {}).get("content", "").strip()
+        if response and response.get("usage"):
+            llm_prompt_tokens = response["usage"].get("prompt_tokens")
+    except Exception as e:
+        logger.error(f"❌ LLM API error: {str(e)}")
+
+    # Fallback logic
+    if not generated_answer:
+        if top_segments:
+            generated_answer = create_direct_answer_from_segments(top_segments)
+        else:
+            generated_answer = "🟢 Bu umumy maglumatlara esaslanyp berilen jogap 💡."
+
+    return apply_turkmen_corrections(generated_answer), llm_prompt_tokens
+
 # -----------------------------
 # Main Function
 # -----------------------------
-async def room_query(prompt: RoomPrompt, current_user: dict = Depends(get_current_user)) -> QueryResponse:
+def build_lean_response(generated_answer: str, top_segments: List[Tuple[str, str, float]], metadata: dict) -> dict:
+    """Version 2 payload (QueryResponseLean) as a plain dict, serialized without a Pydantic round-trip"""
+    segments = []
+    for i, (title, content, similarity) in enumerate(top_segments, 1):
+        truncated_content = smart_truncate_text(content)
+        segments.append({
+            "index": i,
+            "title": title,
+            "content": truncated_content,
+            "similarity": round(float(similarity), 4),
+            "truncated": len(truncated_content) < len(content),
+        })
+    return {"version": 2, "answer": generated_answer, "segments": segments, "metadata": metadata}
+
+async def room_query(prompt: RoomPrompt, current_user: dict = Depends(get_current_user), legacy: bool = True) -> Union[QueryResponse, dict]:
     if not prompt.user_prompt or not prompt.user_prompt.strip():
         raise HTTPException(status_code=400, detail="⚠️ Empty query submitted ❗")
 
@@ -152,57 +269,58 @@ async def room_query(prompt: RoomPrompt, current_user: dict = Depends(get_curren
     previous_messages = []
     try:
         with get_db_cursor() as cur:
-            cur.execute(
-                "SELECT type_user, prompt FROM chatmessage WHERE room_id=%s ORDER BY id ASC",
-                (room_id,)
-            )
+            cur.execute(PREVIOUS_MESSAGES_QUERY, (room_id,))
             previous_messages = cur.fetchall()
     except Exception as e:
         logger.error(f"❌ Could not fetch previous messages: {str(e)}")
 
-    context_text = ""
-    for msg in previous_messages:
-        role = "👤 User" if msg['type_user'] else "🤖 Assistant"
-        context_text += f"{role}: {msg['prompt']}\n"
-
     # Retrieve RAG segments
     try:
-        top_segments = retrieve_segments(prompt.user_prompt, prompt.top_k, prompt.similarity_threshold)
+        # embedding + scoring is CPU/DB bound; keep it off the event loop
+        top_segments = await run_in_threadpool(
+            retrieve_segments, prompt.user_prompt, prompt.top_k, prompt.similarity_threshold, prompt.filters
+        )
     except Exception as e:
         logger.error(f"❌ Could not retrieve info: {str(e)}")
         top_segments = []
 
-    # Build messages for LLM
-    system_message = {"role": "system", "content": create_system_prompt()}
-    user_message_content = f"{context_text}\n👤 User soragy: {prompt.user_prompt}"
-    if top_segments:
-        context_segment_text = "\n".join([f"{title}: {content}" for title, content, _ in top_segments])
-        user_message_content += f"\n\n📌 Relevant info:\n{context_segment_text}"
-    user_message = {"role": "user", "content": user_message_content}
+    # Pack history and segments into the prompt token budget
+    messages, packed_segments, packing = build_llm_messages(prompt.user_prompt, previous_messages, top_segments)
+    prompt_tokens, history_tokens, segment_tokens = packing
 
     # Call LLM
-    generated_answer = ""
-    try:
-        response = await call_llm_api([system_message, user_message], prompt.temperature, prompt.max_tokens)
-        if response and "choices" in response and response["choices"]:
-            generated_answer = response["choices"][0].get("message", {}).get("content", "").strip()
-    except Exception as e:
-        logger.error(f"❌ LLM API error: {str(e)}")
-
-    # Fallback logic
-    if not generated_answer:
-        if top_segments:
-            generated_answer = create_direct_answer_from_segments(top_segments)
-        else:
-            generated_answer = "🟢 Bu umumy maglumatlara esaslanyp berilen jogap 💡."
-
-    generated_answer = apply_turkmen_corrections(generated_answer)
+    generated_answer, llm_prompt_tokens = await generate_answer(messages, top_segments, prompt.temperature, prompt.max_tokens)
 
     try:
         save_chat_message(room_id, generated_answer, type_user=False)
     except DatabaseError as e:
         logger.error(f"❌ Could not save bot response: {str(e)}")
 
+    metadata = {
+        "model": MODEL_NAME,
+        "temperature": prompt.temperature,
+        "max_tokens": prompt.max_tokens,
+        "segments_used": len(top_segments),
+        "segments_packed": len(packed_segments),
+        "prompt_tokens_estimated": prompt_tokens,
+        "prompt_tokens": llm_prompt_tokens if llm_prompt_tokens is not None else prompt_tokens,
+        "prompt_token_budget": PROMPT_TOKEN_BUDGET,
+        "history_tokens": history_tokens,
+        "segment_tokens": segment_tokens,
+        "similarity_threshold": prompt.similarity_threshold,
+        "top_k": prompt.top_k,
+        "filters": prompt.filters.dict(exclude_none=True) if prompt.filters else None,
+        "no_relevant_data": not bool(top_segments),
+        "chatroom_id": room_id,
+        "chatroom_title": room_title,
+        "user_id": user_id,
+        "data_source": "database_and_general_knowledge",
+        "processing_successful": True
+    }
+
+    if not legacy:
+        return build_lean_response(generated_answer, top_segments, metadata)
+
     context_segments = [
         {
             "title": title,
@@ -227,18 +345,5 @@ async def room_query(prompt: RoomPrompt, current_user: dict = Depends(get_curren
         generated_response=generated_answer,
         context_segments=context_segments,
         response=generated_answer,
-        metadata={
-            "model": MODEL_NAME,
-            "temperature": prompt.temperature,
-            "max_tokens": prompt.max_tokens,
-            "segments_used": len(top_segments),
-            "similarity_threshold": prompt.similarity_threshold,
-            "top_k": prompt.top_k,
-            "no_relevant_data": not bool(top_segments),
-            "chatroom_id": room_id,
-            "chatroom_title": room_title,
-            "user_id": user_id,
-            "data_source": "database_and_general_knowledge",
-            "processing_successful": True
-        }
+        metadata=metadata
     )
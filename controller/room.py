@@ -1,45 +1,121 @@
 from fastapi import HTTPException
-from utils.user_verify import verify_room_ownership, get_db_cursor
 from fastapi import  HTTPException, Depends
 from utils.user_verify import get_current_user
+from fastapi.responses import StreamingResponse
 from models.chat_models import ChatMessage ,ChatHistoryResponse
-from utils.room import get_room_messages
+from utils.room import get_room_messages, get_room_info, iter_room_messages_ndjson
+from utils.room_deletion import schedule_room_deletion, get_deletion_job
+from utils.responses import dumps_line
+from typing import Optional
+from datetime import datetime
 
 def delete_room(room_id: int, current_user: dict):
-    """Delete a chatroom if the authenticated user owns it"""
+    """Delete a chatroom if the authenticated user owns it.
+
+    The room disappears immediately; its messages are purged in the background.
+    """
     try:
         user_id = current_user.get("user_id")
-        if not verify_room_ownership(room_id, user_id):
+        job = schedule_room_deletion(user_id, room_ids=[room_id])
+        if job is None:
             raise HTTPException(status_code=403, detail="You don't have access to this room")
 
-        with get_db_cursor() as cur:
-            cur.execute("DELETE FROM chatmessage WHERE room_id = %s", (room_id,))
-            cur.execute("DELETE FROM chatroom WHERE id = %s", (room_id,))
-
-        return {"status": "success", "message": f"Room {room_id} deleted successfully"}
+        return {"status": "success", "message": f"Room {room_id} deleted successfully", "job": job}
 
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+def delete_rooms_bulk(
+    current_user: dict,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None
+):
+    """Delete all of the user's rooms, optionally only those created in [created_from, created_to)"""
+    try:
+        job = schedule_room_deletion(current_user.get("user_id"), created_from=created_from, created_to=created_to)
+        if job is None:
+            return {"status": "success", "message": "No rooms to delete", "job": None}
+        return {"status": "success", "message": f"{job['rooms_total']} rooms deleted", "job": job}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+def get_room_deletion_status(job_id: int, current_user: dict):
+    """Progress of a room deletion job owned by the user"""
+    try:
+        job = get_deletion_job(job_id, current_user.get("user_id"))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal server error")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return job
     
 
-def get_room_chat_history(room_id: int, current_user: dict = Depends(get_current_user)):
-    """Retrieve all messages for a specific room if user owns it"""
+def get_room_chat_history(
+    room_id: int,
+    current_user: dict = Depends(get_current_user),
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None
+):
+    """Retrieve messages for a specific room if user owns it (a page of them when limit is given)"""
     try:
         user_id = current_user.get("user_id")
-        
-        if not verify_room_ownership(room_id, user_id):
+
+        result = get_room_messages(room_id, user_id, before=before, after=after, limit=limit)
+        if result is None:
             raise HTTPException(status_code=403, detail="You don't have access to this room")
-        
-        result = get_room_messages(room_id, user_id)
+
         messages = [ChatMessage(**msg) for msg in result["messages"]]
-        
+
         return ChatHistoryResponse(
             messages=messages,
-            room_info=result["room_info"]
+            room_info=result["room_info"],
+            has_more=result["has_more"]
         )
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail="Internal server error")
+
+
+def stream_room_chat_history(
+    room_id: int,
+    current_user: dict,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None
+):
+    """Stream messages of a room as NDJSON, oldest first like the JSON page.
+
+    Without limit the rows are streamed from a server-side cursor; a limited page
+    is small and is fetched up front so that X-Has-More can be sent.
+    """
+    user_id = current_user.get("user_id")
+    if limit is not None:
+        try:
+            result = get_room_messages(room_id, user_id, before=before, after=after, limit=limit)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail="Internal server error")
+        if result is None:
+            raise HTTPException(status_code=403, detail="You don't have access to this room")
+        return StreamingResponse(
+            iter(dumps_line(msg) for msg in result["messages"]),
+            media_type="application/x-ndjson",
+            headers={"X-Has-More": "true" if result["has_more"] else "false"}
+        )
+
+    try:
+        room_info = get_room_info(room_id, user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal server error")
+    if room_info is None:
+        raise HTTPException(status_code=403, detail="You don't have access to this room")
+
+    return StreamingResponse(
+        iter_room_messages_ndjson(room_id, before=before, after=after),
+        media_type="application/x-ndjson"
+    )
@@ -0,0 +1,228 @@
+# database/migrate.py
+"""Ordered, idempotent schema migrations.
+
+Every file in migrations/versions/ named NNN_description.sql is applied once,
+in version order, each inside its own transaction. Applied versions are
+recorded in schema_migrations; an advisory lock keeps concurrently starting
+workers from racing.
+
+    python -m database.migrate            # apply pending migrations
+    python -m database.migrate status     # list applied / pending
+    python -m database.migrate explain    # check that hot queries can use index scans
+"""
+import argparse
+import hashlib
+import json
+import logging
+import re
+import sys
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from database.db import get_db_connection
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations" / "versions"
+MIGRATION_FILE_RE = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+ADVISORY_LOCK_ID = 72_914_001
+
+
+def discover_migrations(directory: Path = MIGRATIONS_DIR) -> List[Tuple[str, str, Path]]:
+    """(version, name, path) for every migration file, ordered by version"""
+    migrations = []
+    for path in directory.iterdir():
+        match = MIGRATION_FILE_RE.match(path.name)
+        if match:
+            migrations.append((match.group(1), match.group(2), path))
+    versions = [v for v, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError("Duplicate migration versions in " + str(directory))
+    return sorted(migrations, key=lambda m: int(m[0]))
+
+
+def _checksum(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+def _ensure_table(cur) -> None:
+    cur.execute(
+        """CREATE TABLE IF NOT EXISTS schema_migrations (
+               version TEXT PRIMARY KEY,
+               name TEXT NOT NULL,
+               checksum TEXT NOT NULL,
+               applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+           )"""
+    )
+
+
+def applied_migrations(cur) -> dict:
+    _ensure_table(cur)
+    cur.execute("SELECT version, checksum FROM schema_migrations")
+    return {row['version']: row['checksum'] for row in cur.fetchall()}
+
+
+def migrate() -> List[str]:
+    """Apply all pending migrations; returns the versions applied"""
+    conn = get_db_connection()
+    applied_now = []
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+        try:
+            applied = applied_migrations(cur)
+            conn.commit()
+            for version, name, path in discover_migrations():
+                sql = path.read_text(encoding="utf-8")
+                if version in applied:
+                    if applied[version] != _checksum(sql):
+                        logger.warning(f"Migration {version}_{name} changed after it was applied")
+                    continue
+                logger.info(f"Applying migration {version}_{name}")
+                try:
+                    cur.execute(sql)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                        (version, name, _checksum(sql))
+                    )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    logger.error(f"Migration {version}_{name} failed, stopping")
+                    raise
+                applied_now.append(version)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+            conn.commit()
+            cur.close()
+    finally:
+        conn.close()
+    return applied_now
+
+
+def status() -> List[Tuple[str, str, bool]]:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        applied = applied_migrations(cur)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return [(version, name, version in applied) for version, name, _ in discover_migrations()]
+
+
+# -----------------------------
+# EXPLAIN checks for hot queries
+# -----------------------------
+INDEX_NODE_TYPES = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+
+def hot_queries(user_id: int = 1, room_id: int = 1, search: str = "kanun") -> List[Tuple[str, str, tuple, Optional[str]]]:
+    """(description, SQL, params, index the plan must use or None) built by the app's own query builders.
+
+    Name the index wherever another index could serve the query too: with seq scans
+    off, the primary key alone yields an ordered index scan for any ORDER BY id.
+    """
+    # imported here: the migration runner itself must work without the web app's dependencies
+    from routers.users import USER_BY_NAME_QUERY
+    from utils.room import (
+        ROOM_OWNERSHIP_QUERY, PREVIOUS_MESSAGES_QUERY, _message_page_query, _user_rooms_query
+    )
+
+    history_sql, history_params = _message_page_query(1000, None, 50)
+    return [
+        ("login lookup (routers/users.fetch_user)",
+         USER_BY_NAME_QUERY, ("admin",), "users_name_idx"),
+        ("room ownership (utils/room._fetch_owned_room)",
+         ROOM_OWNERSHIP_QUERY, (room_id, user_id), None),
+        ("room list, first page (utils/room.get_user_rooms)",
+         *_user_rooms_query(user_id, None, 20, 0, None), "chatroom_user_created_id_live_idx"),
+        ("room list, keyset page (utils/room.get_user_rooms)",
+         *_user_rooms_query(user_id, None, 20, 0, ("2100-01-01T00:00:00+00:00", 1000)),
+         "chatroom_user_created_id_live_idx"),
+        ("room title search (utils/room.get_user_rooms)",
+         *_user_rooms_query(user_id, search, 20, 0, None), "chatroom_title_trgm_idx"),
+        ("previous messages (controller/chat.room_query)",
+         PREVIOUS_MESSAGES_QUERY, (room_id,), "chatmessage_room_id_id_idx"),
+        ("history page (utils/room.get_room_messages)",
+         history_sql, (room_id, *history_params), "chatmessage_room_id_id_idx"),
+    ]
+
+
+def _plan_nodes(plan: dict) -> List[dict]:
+    nodes = [plan]
+    for child in plan.get("Plans", []):
+        nodes.extend(_plan_nodes(child))
+    return nodes
+
+
+def explain_plan(cur, sql: str, params: tuple) -> dict:
+    """Root node of EXPLAIN (FORMAT JSON) for the query"""
+    cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+    plan = cur.fetchone()["QUERY PLAN"]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def plan_uses_index(plan: dict, index_name: Optional[str] = None) -> bool:
+    """True if the plan scans an index; with index_name, only if it scans that one"""
+    for node in _plan_nodes(plan):
+        if node["Node Type"] in INDEX_NODE_TYPES and index_name in (None, node.get("Index Name")):
+            return True
+    return False
+
+
+def explain_hot_queries(conn=None, **sample) -> List[Tuple[str, bool, List[str]]]:
+    """EXPLAIN each hot query with seq scans disabled; (description, uses the expected index, plan nodes).
+
+    Sequential scans are disabled because on small development tables the planner
+    rightly prefers them, which says nothing about whether the indexes are in place.
+    A query that names an expected index only passes when that index is in the plan,
+    since another index on the table (e.g. the user_id btree) would satisfy any
+    index scan check on its own. `sample` overrides hot_queries' sample parameters.
+    """
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    results = []
+    try:
+        cur = conn.cursor()
+        cur.execute("SET enable_seqscan = off")
+        try:
+            for description, sql, params, index_name in hot_queries(**sample):
+                plan = explain_plan(cur, sql, params)
+                nodes = [
+                    f"{node['Node Type']} on {node['Index Name']}" if node.get("Index Name") else node["Node Type"]
+                    for node in _plan_nodes(plan)
+                ]
+                results.append((description, plan_uses_index(plan, index_name), nodes))
+            if not own_conn:
+                cur.execute("RESET enable_seqscan")
+        finally:
+            cur.close()
+    finally:
+        if own_conn:
+            conn.rollback()
+            conn.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database migrations")
+    parser.add_argument("command", nargs="?", default="up", choices=["up", "status", "explain"])
+    args = parser.parse_args()
+
+    if args.command == "up":
+        applied = migrate()
+        print(f"Applied {len(applied)} migration(s): {', '.join(applied) or '-'}")
+    elif args.command == "status":
+        for version, name, done in status():
+            print(f"{'applied' if done else 'pending':>8}  {version}_{name}")
+    else:
+        failed = False
+        for description, uses_index, nodes in explain_hot_queries():
+            print(f"{'OK ' if uses_index else 'BAD'}  {description}: {', '.join(nodes)}")
+            failed = failed or not uses_index
+        sys.exit(1 if failed else 0)
@@ -1,8 +1,11 @@
 # app/main.py
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routers import users, llm
+from fastapi.middleware.gzip import GZipMiddleware
+from routers import users, llm, admin
+from utils.responses import CompressionMiddleware
 from dotenv import load_dotenv
+import os
 
 
 load_dotenv(override=True) 
@@ -23,7 +26,63 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],         
     allow_headers=["*"],  
-    expose_headers=["x-captcha-id"]
+    expose_headers=["x-captcha-id", "x-profile-file", "x-has-more"]
 )
+
+# Compress large answer/history payloads; brotli when brotli-asgi is installed (falls back to gzip).
+# NDJSON streams are left uncompressed so each line is delivered as soon as it is written
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(
+        CompressionMiddleware, compressor=BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=True
+    )
+except ImportError:
+    app.add_middleware(CompressionMiddleware, compressor=GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
 app.include_router(users.router)
 app.include_router(llm.router)
+app.include_router(admin.router)
+
+# Per-request profiling (X-Profile header from admins, or PROFILING_SAMPLE_RATE);
+# not installed at all unless enabled, so it adds nothing to normal requests
+from utils.profiling import PROFILING_ENABLED, ProfilingMiddleware
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+
+@app.on_event("startup")
+def start_background_workers():
+    from utils.llm_call import RETRIEVAL_INDEX_MODE, encode_texts
+    from utils.vector_index import INDEX_MODES, start_index_build
+    from utils.document_listener import start_document_listener
+    from utils.captcha_pool import start_captcha_pool
+    from utils.room_deletion import start_room_purger
+    from utils.room_titles import start_room_title_worker
+
+    start_captcha_pool()
+    start_room_purger()
+    start_room_title_worker()
+
+    # built off the request path; retrieval scans until it is ready
+    if RETRIEVAL_INDEX_MODE in INDEX_MODES:
+        start_index_build(RETRIEVAL_INDEX_MODE, encode_texts)
+
+    # keeps the in-memory index / snapshot overlay in sync with the documents table
+    listener_default = "false" if RETRIEVAL_INDEX_MODE == "scan" else "true"
+    if os.getenv("DOCUMENTS_LISTENER_ENABLED", listener_default).lower() == "true":
+        start_document_listener(encode_texts, use_snapshot=RETRIEVAL_INDEX_MODE == "snapshot")
+
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    from utils.document_listener import stop_document_listener
+    from utils.captcha_pool import stop_captcha_pool
+    from utils.passwords import password_hasher
+    from utils.room_deletion import stop_room_purger
+    from utils.room_titles import stop_room_title_worker
+
+    stop_room_title_worker()
+    stop_document_listener()
+    stop_captcha_pool()
+    stop_room_purger()
+    password_hasher.shutdown()
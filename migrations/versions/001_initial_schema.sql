@@ -0,0 +1,32 @@
+-- Full application schema. Every statement is idempotent so that the
+-- migration also succeeds on databases created by hand before migrations
+-- were tracked.
+CREATE EXTENSION IF NOT EXISTS vector;
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    password TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS chatroom (
+    id SERIAL PRIMARY KEY,
+    title TEXT NOT NULL,
+    user_id INT REFERENCES users(id) ON DELETE CASCADE,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS chatmessage (
+    id SERIAL PRIMARY KEY,
+    type_user BOOLEAN NOT NULL,
+    room_id INT NOT NULL REFERENCES chatroom(id) ON DELETE CASCADE,
+    prompt TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS documents (
+    id SERIAL PRIMARY KEY,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL,
+    embedding vector(1024) NOT NULL
+);
@@ -0,0 +1,21 @@
+-- Databases created before 001 may have chatmessage.room_id without
+-- ON DELETE CASCADE (or without a foreign key at all): replace it.
+DO $$
+DECLARE
+    fk record;
+BEGIN
+    FOR fk IN
+        SELECT c.conname
+        FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY (c.conkey)
+        WHERE c.conrelid = 'chatmessage'::regclass
+          AND c.contype = 'f'
+          AND a.attname = 'room_id'
+    LOOP
+        EXECUTE format('ALTER TABLE chatmessage DROP CONSTRAINT %I', fk.conname);
+    END LOOP;
+END $$;
+
+ALTER TABLE chatmessage
+    ADD CONSTRAINT chatmessage_room_id_fkey
+    FOREIGN KEY (room_id) REFERENCES chatroom(id) ON DELETE CASCADE;
@@ -0,0 +1,2 @@
+-- Login lookup (routers/users.fetch_user): WHERE name = %s
+CREATE INDEX IF NOT EXISTS users_name_idx ON users (name);
@@ -0,0 +1,9 @@
+-- Room listing (utils/room.get_user_rooms): keyset pagination on
+-- (created_at, id) per user, and trigram index for title ILIKE search.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS chatroom_user_created_id_idx
+    ON chatroom (user_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS chatroom_title_trgm_idx
+    ON chatroom USING gin (title gin_trgm_ops);
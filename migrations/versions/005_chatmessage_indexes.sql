@@ -0,0 +1,4 @@
+-- Chat history pagination (utils/room.get_room_messages) and the
+-- previous-messages lookup in controller/chat.room_query.
+CREATE INDEX IF NOT EXISTS chatmessage_room_id_id_idx
+    ON chatmessage (room_id, id);
@@ -0,0 +1,4 @@
+-- Approximate nearest-neighbour index on the document vectors for
+-- pgvector distance queries (cosine, matching the retrieval scoring).
+CREATE INDEX IF NOT EXISTS documents_embedding_hnsw_idx
+    ON documents USING hnsw (embedding vector_cosine_ops);
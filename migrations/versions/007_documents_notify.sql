@@ -0,0 +1,17 @@
+-- Emit a NOTIFY on every change to documents so that running app workers can
+-- update their in-memory retrieval index (see utils/document_listener.py).
+CREATE OR REPLACE FUNCTION notify_documents_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('documents_changed', json_build_object('op', TG_OP, 'id', OLD.id)::text);
+        RETURN OLD;
+    END IF;
+    PERFORM pg_notify('documents_changed', json_build_object('op', TG_OP, 'id', NEW.id)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS documents_notify_change ON documents;
+CREATE TRIGGER documents_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON documents
+    FOR EACH ROW EXECUTE FUNCTION notify_documents_change();
@@ -0,0 +1,30 @@
+-- Asynchronous room deletion (utils/room_deletion.py): rooms are hidden
+-- immediately via deleted_at and purged in the background per job.
+CREATE TABLE IF NOT EXISTS room_deletion_job (
+    id SERIAL PRIMARY KEY,
+    user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    status TEXT NOT NULL DEFAULT 'pending',
+    rooms_total INT NOT NULL DEFAULT 0,
+    rooms_purged INT NOT NULL DEFAULT 0,
+    messages_purged BIGINT NOT NULL DEFAULT 0,
+    created_from TIMESTAMPTZ,
+    created_to TIMESTAMPTZ,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS room_deletion_job_open_idx
+    ON room_deletion_job (id) WHERE status IN ('pending', 'running');
+
+ALTER TABLE chatroom ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;
+ALTER TABLE chatroom ADD COLUMN IF NOT EXISTS deletion_job_id INT
+    REFERENCES room_deletion_job(id) ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS chatroom_deletion_job_idx
+    ON chatroom (deletion_job_id) WHERE deletion_job_id IS NOT NULL;
+
+-- room listing only ever reads live rooms
+DROP INDEX IF EXISTS chatroom_user_created_id_idx;
+CREATE INDEX IF NOT EXISTS chatroom_user_created_id_live_idx
+    ON chatroom (user_id, created_at DESC, id DESC) WHERE deleted_at IS NULL;
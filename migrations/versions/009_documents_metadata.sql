@@ -0,0 +1,11 @@
+-- Structured metadata for filtered retrieval (see utils/llm_call.py,
+-- document_filter_clause). Filled in by the ingestion job; rows without
+-- metadata only match unfiltered queries.
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS code_id TEXT;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS article_number TEXT;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS effective_date DATE;
+
+CREATE INDEX IF NOT EXISTS documents_code_article_idx
+    ON documents (code_id, article_number);
+CREATE INDEX IF NOT EXISTS documents_effective_date_idx
+    ON documents (effective_date);
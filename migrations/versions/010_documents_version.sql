@@ -0,0 +1,20 @@
+-- Cheap change counter for `documents`: bumped once per modifying statement
+-- (any column, including embedding). utils/embedding_snapshot.db_fingerprint
+-- compares it with the version recorded in the snapshot file.
+CREATE TABLE IF NOT EXISTS documents_version (
+    id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO documents_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_documents_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE documents_version SET version = version + 1 WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS documents_bump_version ON documents;
+CREATE TRIGGER documents_bump_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON documents
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_documents_version();
@@ -0,0 +1,18 @@
+-- Per-row change time so that the documents listener can catch up on the
+-- changes it missed while disconnected (utils/document_listener.py) instead
+-- of rebuilding the in-memory index.
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS documents_updated_at_idx ON documents (updated_at);
+
+CREATE OR REPLACE FUNCTION touch_documents_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at = now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS documents_touch_updated_at ON documents;
+CREATE TRIGGER documents_touch_updated_at
+    BEFORE UPDATE ON documents
+    FOR EACH ROW EXECUTE FUNCTION touch_documents_updated_at();
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Tuple, Optional
+from datetime import date
 
 class Prompt(BaseModel):
     user_prompt: str
@@ -8,6 +9,12 @@ class Prompt(BaseModel):
     top_k: Optional[int] = 3
     similarity_threshold: Optional[float] = 0.3
 
+class DocumentFilters(BaseModel):
+    """Restrict retrieval to documents of given codes/laws, articles, or in force on a date"""
+    code_ids: Optional[List[str]] = None
+    article_numbers: Optional[List[str]] = None
+    effective_on: Optional[date] = None
+
 class RoomPrompt(BaseModel):
     user_prompt: str
     room_id: Optional[int] = None
@@ -15,6 +22,18 @@ class RoomPrompt(BaseModel):
     max_tokens: Optional[int] = 100
     top_k: Optional[int] = 3
     similarity_threshold: Optional[float] = 0.3
+    filters: Optional[DocumentFilters] = None
+
+class BatchQueryRequest(BaseModel):
+    """Many prompts answered in one call; results are streamed back as NDJSON"""
+    prompts: List[str]
+    temperature: Optional[float] = 0.3
+    max_tokens: Optional[int] = 100
+    top_k: Optional[int] = 3
+    similarity_threshold: Optional[float] = 0.3
+    filters: Optional[DocumentFilters] = None
+    persist: bool = False
+    concurrency: Optional[int] = None
 
 class QueryResponse(BaseModel):
     found_context: List[dict]
@@ -23,6 +42,20 @@ class QueryResponse(BaseModel):
     response: str
     metadata: dict
 
+class LeanSegment(BaseModel):
+    index: int
+    title: str
+    content: str
+    similarity: float
+    truncated: bool
+
+class QueryResponseLean(BaseModel):
+    """Version 2 of the room-query payload: the answer and each segment are sent once"""
+    version: int = 2
+    answer: str
+    segments: List[LeanSegment]
+    metadata: dict
+
 class ChatMessage(BaseModel):
     id: int
     type_user: bool
@@ -33,6 +66,7 @@ class ChatMessage(BaseModel):
 class ChatHistoryResponse(BaseModel):
     messages: List[ChatMessage]
     room_info: dict
+    has_more: bool = False
 
 class Room(BaseModel):
     id: int
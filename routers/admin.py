@@ -0,0 +1,29 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import FileResponse
+import logging
+from utils.user_verify import require_admin
+from utils.profiling import list_profiles, profile_path, get_profiling_stats
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/api/v1/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin)]
+)
+
+
+@router.get("/profiles")
+def get_profiles():
+    """Saved request profiles, newest first"""
+    return {"profiling": get_profiling_stats(), "profiles": list_profiles()}
+
+
+@router.get("/profiles/{name}")
+def download_profile(name: str):
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "application/json" if name.endswith(".json") else "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=name)
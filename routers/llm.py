@@ -1,11 +1,26 @@
 from fastapi import APIRouter, HTTPException, Depends
 import logging
-from models.chat_models import QueryResponse , Prompt,RoomResponse,ChatHistoryResponse,RoomPrompt
-from utils.room import get_user_rooms
-from controller.room import delete_room , get_room_chat_history
+from models.chat_models import QueryResponse , Prompt,RoomResponse,ChatHistoryResponse,RoomPrompt,QueryResponseLean,BatchQueryRequest
+from utils.room import get_user_rooms, decode_room_cursor
+from controller.room import (
+    delete_room, get_room_chat_history, stream_room_chat_history, delete_rooms_bulk, get_room_deletion_status
+)
 from controller.chat import room_query
-from typing import Optional
+from controller.batch import batch_query
+from utils.llm_call import get_llm_coalesce_stats
+from utils.vector_index import get_index_stats
+from utils.embedding_snapshot import get_snapshot_stats
+from utils.document_listener import get_listener_stats
+from utils.captcha_pool import get_captcha_pool_stats
+from utils.passwords import get_password_hasher_stats
+from utils.rate_limit import rate_limit_by_user, get_rate_limit_stats
+from utils.room_deletion import get_room_purger_stats
+from utils.profiling import get_profiling_stats
+from utils.room_titles import get_room_title_stats
+from typing import Optional, Union
+from datetime import datetime
 from fastapi import Query
+from utils.responses import FastJSONResponse
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -14,7 +29,7 @@ router = APIRouter(
     tags=["llm"]
 )
 
-from utils.user_verify import get_current_user
+from utils.user_verify import get_current_user, require_admin
 # @router.post("/query", response_model=QueryResponse)
 # async def query(prompt: Prompt, current_user: dict = Depends(get_current_user)):
 #     """Process text query and return response with context - Creates new room"""
@@ -140,12 +155,27 @@ from utils.user_verify import get_current_user
 #         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-@router.post("/room-query", response_model=QueryResponse)
+@router.post(
+    "/room-query",
+    response_model=Union[QueryResponseLean, QueryResponse],
+    response_class=FastJSONResponse,
+    dependencies=[Depends(rate_limit_by_user("room_query"))]
+)
 async def room_query_endpoint(
     prompt: RoomPrompt,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    legacy: bool = Query(False, description="Return the pre-v2 QueryResponse shape")
 ):
-    return await room_query(prompt, current_user)
+    result = await room_query(prompt, current_user, legacy=legacy)
+    if legacy:
+        return result
+    return FastJSONResponse(result)
+
+
+@router.post("/batch-query", dependencies=[Depends(rate_limit_by_user("batch_query"))])
+async def batch_query_endpoint(request: BatchQueryRequest, current_user: dict = Depends(get_current_user)):
+    """Answer many prompts in one call (offline evaluation); streams one NDJSON line per prompt plus a summary"""
+    return await batch_query(request, current_user)
 from pydantic import BaseModel
 from typing import List, Dict
 
@@ -158,21 +188,28 @@ class Room(BaseModel):
 class RoomResponse(BaseModel):
     rooms: List[Room]
     has_next: bool
+    next_cursor: Optional[str] = None
 
 @router.get("/rooms", response_model=RoomResponse)
 async def get_rooms(
     current_user: dict = Depends(get_current_user),
     search: Optional[str] = Query(None, description="Search by room title"),
     limit: int = Query(20, ge=1, le=100),
-    offset: int = Query(0, ge=0)
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
 ):
     """
     Retrieve chatrooms for the authenticated user with optional title search
     and pagination (for infinite scroll)
     """
+    if cursor:
+        try:
+            decode_room_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     try:
         user_id = current_user.get("user_id")
-        result = get_user_rooms(user_id=user_id, search=search, limit=limit, offset=offset)
+        result = get_user_rooms(user_id=user_id, search=search, limit=limit, offset=offset, cursor=cursor)
         return RoomResponse(**result)
     except Exception as e:
         logger.error(f"Error in get_rooms endpoint: {e}")
@@ -180,15 +217,53 @@ async def get_rooms(
 
 
 @router.get("/room/{room_id}/messages", response_model=ChatHistoryResponse)
-async def get_room_message( 
+def get_room_message(
     room_id:int,
-    current_user: dict = Depends(get_current_user)):
-    return get_room_chat_history(room_id,current_user)
+    current_user: dict = Depends(get_current_user),
+    before: Optional[int] = Query(None, description="Only messages with id < before (newest page first)"),
+    after: Optional[int] = Query(None, description="Only messages with id > after"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size, latest messages unless after is given; whole room if omitted"),
+    stream: bool = Query(False, description="Stream the messages as NDJSON")):
+    if stream:
+        return stream_room_chat_history(room_id, current_user, before=before, after=after, limit=limit)
+    return get_room_chat_history(room_id, current_user, before=before, after=after, limit=limit)
 
 
 @router.delete("/room/{room_id}")
-async def delete_room_end(
+def delete_room_end(
     room_id:int,
     current_user: dict = Depends(get_current_user)
 ):
     return delete_room(room_id,current_user)
+
+
+@router.delete("/rooms")
+def delete_rooms(
+    current_user: dict = Depends(get_current_user),
+    created_from: Optional[datetime] = Query(None, description="Only rooms created at or after this time"),
+    created_to: Optional[datetime] = Query(None, description="Only rooms created before this time")
+):
+    """Delete all of the user's rooms (or those in a date range) in the background"""
+    return delete_rooms_bulk(current_user, created_from=created_from, created_to=created_to)
+
+
+@router.get("/room-deletions/{job_id}")
+def get_room_deletion(job_id: int, current_user: dict = Depends(get_current_user)):
+    return get_room_deletion_status(job_id, current_user)
+
+
+@router.get("/stats")
+def get_stats(current_user: dict = Depends(require_admin)):
+    """Runtime counters for the LLM pipeline (admins only); sync so the room purger's DB count runs in the threadpool"""
+    return {
+        "llm_coalescing": get_llm_coalesce_stats(),
+        "retrieval_index": get_index_stats(),
+        "embedding_snapshot": get_snapshot_stats(),
+        "documents_listener": get_listener_stats(),
+        "captcha_pool": get_captcha_pool_stats(),
+        "password_hashing": get_password_hasher_stats(),
+        "rate_limiting": get_rate_limit_stats(),
+        "room_purger": get_room_purger_stats(),
+        "profiling": get_profiling_stats(),
+        "room_titles": get_room_title_stats(),
+    }
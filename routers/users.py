@@ -1,14 +1,20 @@
 from fastapi import APIRouter, HTTPException, Depends, Body
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from database.db import get_db_connection
 from models.auth import AuthService
-import bcrypt
+from starlette.concurrency import run_in_threadpool
+from utils.passwords import (
+    hash_password_async, verify_password_async, needs_rehash, PasswordHasherBusy
+)
 from utils.jwt import decode_token, create_access_token, create_refresh_token
 from pydantic import BaseModel
-from captcha.image import ImageCaptcha
-import io, random, string, uuid, time
-from typing import Dict
+from utils.captcha_pool import get_captcha_image
+from utils.rate_limit import rate_limit_by_ip
+import uuid, time, logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/api/v1/auth",
@@ -30,13 +36,51 @@ def cleanup_expired_captchas():
         del CAPTCHA_CACHE[key]
 
 # ---------------- Parola işlemleri ----------------
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+# bcrypt ayrı process havuzunda çalışır (utils/passwords.py); havuz doluysa hemen 503 döner
+def password_hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, please retry",
+        headers={"Retry-After": "1"}
+    )
+
+def insert_user(name: str, hashed_pwd: str) -> dict:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO users (name, password) VALUES (%s, %s) RETURNING id, name",
+            (name, hashed_pwd)
+        )
+        row = cur.fetchone()
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    return row
+
+USER_BY_NAME_QUERY = "SELECT id, name, password FROM users WHERE name = %s"
+
+def fetch_user(name: str) -> Optional[dict]:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(USER_BY_NAME_QUERY, (name,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        conn.close()
+    return row
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+def update_password_hash(user_id: int, hashed_pwd: str) -> None:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("UPDATE users SET password = %s WHERE id = %s", (hashed_pwd, user_id))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
 
 # ---------------- Refresh token request modeli ----------------
 class RefreshTokenRequest(BaseModel):
@@ -48,12 +92,13 @@ class LoginRequest(BaseModel):
     captcha_id: str
 
 # ---------------- CAPTCHA ----------------
-@router.get("/captcha")
+@router.get("/captcha", dependencies=[Depends(rate_limit_by_ip("captcha"))])
 def get_captcha():
     cleanup_expired_captchas()
 
     captcha_id = str(uuid.uuid4())
-    captcha_text = ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
+    # Havuzdan önceden çizilmiş CAPTCHA al (boşsa burada çizilir)
+    captcha_text, image_png = get_captcha_image()
 
     CAPTCHA_CACHE[captcha_id] = {
         'text': captcha_text,
@@ -61,13 +106,7 @@ def get_captcha():
         'used': False
     }
 
-    # CAPTCHA resmi oluştur
-    image_captcha = ImageCaptcha(width=280, height=90)
-    data = image_captcha.generate(captcha_text)
-    buf = io.BytesIO(data.read())
-    buf.seek(0)
-    print(captcha_text)
-    response = StreamingResponse(buf, media_type="image/png")
+    response = Response(content=image_png, media_type="image/png")
     response.headers["X-Captcha-ID"] = captcha_id
     return response
 
@@ -89,20 +128,12 @@ def verify_captcha(captcha_id: str, input_text: str):
 
 # ---------------- Register ----------------
 @router.post("/register")
-def create_user(user: AuthService):
-    conn = get_db_connection()
+async def create_user(user: AuthService):
     try:
-        cur = conn.cursor()
-        hashed_pwd = hash_password(user.password)
-        cur.execute(
-            "INSERT INTO users (name, password) VALUES (%s, %s) RETURNING id, name",
-            (user.name, hashed_pwd)
-        )
-        row = cur.fetchone()
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+        hashed_pwd = await hash_password_async(user.password)
+    except PasswordHasherBusy:
+        raise password_hasher_busy()
+    row = await run_in_threadpool(insert_user, user.name, hashed_pwd)
 
     access_token = create_access_token({"user_id": row["id"], "name": row["name"]})
     refresh_token = create_refresh_token({"user_id": row["id"], "name": row["name"]})
@@ -115,22 +146,27 @@ def create_user(user: AuthService):
     }
 
 # ---------------- Login ----------------
-@router.post("/login")
-def login_user(login_data: LoginRequest):
+@router.post("/login", dependencies=[Depends(rate_limit_by_ip("login"))])
+async def login_user(login_data: LoginRequest):
     verify_captcha(login_data.captcha_id, login_data.captcha_solution)
 
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT id, name, password FROM users WHERE name = %s", (login_data.user.name,))
-        row = cur.fetchone()
-    finally:
-        cur.close()
-        conn.close()
+    row = await run_in_threadpool(fetch_user, login_data.user.name)
 
-    if row is None or not verify_password(login_data.user.password, row["password"]):
+    try:
+        valid = row is not None and await verify_password_async(login_data.user.password, row["password"])
+    except PasswordHasherBusy:
+        raise password_hasher_busy()
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
+    # BCRYPT_ROUNDS değiştiyse parolayı yeni maliyetle yeniden hashle
+    if needs_rehash(row["password"]):
+        try:
+            new_hash = await hash_password_async(login_data.user.password)
+            await run_in_threadpool(update_password_hash, row["id"], new_hash)
+        except Exception as e:
+            logger.warning(f"Password rehash skipped for user {row['id']}: {e}")
+
     access_token = create_access_token({"user_id": row["id"], "name": row["name"]})
     refresh_token = create_refresh_token({"user_id": row["id"], "name": row["name"]})
 
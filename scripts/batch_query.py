@@ -0,0 +1,61 @@
+"""Run a file of reference questions through the RAG pipeline in one batch.
+
+Reads one question per line (or JSONL with a "prompt" field), writes one
+NDJSON result per question plus a throughput summary. Rooms are only
+stored when --user-id is given.
+
+    python -m scripts.batch_query questions.txt --output answers.ndjson --concurrency 4
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from models.chat_models import BatchQueryRequest
+from controller.batch import iter_batch_query
+
+
+def read_prompts(path: str) -> list:
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                line = json.loads(line)["prompt"]
+            prompts.append(line)
+    return prompts
+
+
+async def run(args) -> None:
+    request = BatchQueryRequest(
+        prompts=read_prompts(args.input),
+        temperature=args.temperature,
+        max_tokens=args.max_tokens,
+        top_k=args.top_k,
+        persist=args.user_id is not None,
+        concurrency=args.concurrency,
+    )
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        async for line in iter_batch_query(request, args.user_id):
+            out.write(line)
+            out.flush()
+            if line.startswith(b'{"summary"'):
+                print(line.decode("utf-8").strip(), file=sys.stderr)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch question answering for offline evaluation")
+    parser.add_argument("input")
+    parser.add_argument("--output")
+    parser.add_argument("--temperature", type=float, default=0.3)
+    parser.add_argument("--max-tokens", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--concurrency", type=int)
+    parser.add_argument("--user-id", type=int, help="store each exchange as a room of this user")
+    asyncio.run(run(parser.parse_args()))
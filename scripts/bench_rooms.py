@@ -0,0 +1,82 @@
+"""Room listing benchmark: OFFSET vs keyset pagination and title search.
+
+Seeds a throwaway user with --rooms chatrooms, walks --pages pages both ways
+and reports per-page latency at increasing depth.
+
+    python -m scripts.bench_rooms --rooms 10000 --page-size 20
+"""
+import argparse
+import time
+
+from utils.user_verify import get_db_cursor
+from utils.room import get_user_rooms
+
+BENCH_USER = "bench_rooms_user"
+
+
+def seed(rooms: int) -> int:
+    with get_db_cursor() as cur:
+        cur.execute("SELECT id FROM users WHERE name = %s", (BENCH_USER,))
+        row = cur.fetchone()
+        if row is None:
+            cur.execute("INSERT INTO users (name, password) VALUES (%s, '!') RETURNING id", (BENCH_USER,))
+            row = cur.fetchone()
+        user_id = row['id']
+        cur.execute("SELECT count(*) AS n FROM chatroom WHERE user_id = %s", (user_id,))
+        missing = rooms - cur.fetchone()['n']
+        if missing > 0:
+            cur.execute(
+                """INSERT INTO chatroom (title, user_id, created_at)
+                   SELECT 'Kanun soragy ' || g || ' salgyt madda', %s, now() - (g || ' seconds')::interval
+                   FROM generate_series(1, %s) g""",
+                (user_id, missing),
+            )
+        cur.execute("ANALYZE chatroom")
+    return user_id
+
+
+def cleanup() -> None:
+    with get_db_cursor() as cur:
+        cur.execute("DELETE FROM chatroom WHERE user_id IN (SELECT id FROM users WHERE name = %s)", (BENCH_USER,))
+        cur.execute("DELETE FROM users WHERE name = %s", (BENCH_USER,))
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, 1000 * (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rooms", type=int, default=10000)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--cleanup", action="store_true", help="Remove the benchmark user and its rooms")
+    args = parser.parse_args()
+
+    if args.cleanup:
+        cleanup()
+        return
+
+    user_id = seed(args.rooms)
+    pages = args.rooms // args.page_size
+    checkpoints = {1, pages // 4, pages // 2, pages - 1}
+
+    print(f"{'page':>6} {'offset ms':>10} {'keyset ms':>10}")
+    cursor = None
+    for page in range(pages):
+        if page in checkpoints:
+            _, offset_ms = timed(lambda: get_user_rooms(user_id, limit=args.page_size, offset=page * args.page_size))
+        result, keyset_ms = timed(lambda: get_user_rooms(user_id, limit=args.page_size, cursor=cursor))
+        if page in checkpoints:
+            print(f"{page:>6} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+        cursor = result["next_cursor"]
+        if not cursor:
+            break
+
+    _, search_ms = timed(lambda: get_user_rooms(user_id, search="soragy 99", limit=args.page_size))
+    print(f"title search: {search_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
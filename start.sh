@@ -28,7 +28,11 @@ echo "Conda environment aktif ediliyor..."
 source ~/miniconda3/etc/profile.d/conda.sh
 conda activate testenv
 
-# --- 4. Uvicorn server'ı çalıştır ---
+# --- 4. Veritabanı migration'larını uygula ---
+echo "Migration'lar uygulanıyor..."
+python -m database.migrate
+
+# --- 5. Uvicorn server'ı çalıştır ---
 echo "Uvicorn server başlatılıyor..."
 uvicorn main:app --reload --host 0.0.0.0 --port 8000
 
@@ -0,0 +1,31 @@
+"""Integration tests against the app's PostgreSQL.
+
+They need DATABASE_URL to point at a scratch database with the pgvector and
+pg_trgm extensions available; migrations are applied once per session. Without
+a reachable database the tests are skipped.
+
+    DATABASE_URL=postgresql://postgres:12@localhost:5432/ragdb_test python -m pytest -q
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def database():
+    psycopg2 = pytest.importorskip("psycopg2")
+    from database.db import get_db_connection, DATABASE_URL
+
+    try:
+        get_db_connection().close()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"database {DATABASE_URL} not reachable: {e}")
+
+    from database.migrate import migrate
+    migrate()
+    return DATABASE_URL
@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pgvector")
+pytest.importorskip("fastapi")
+
+from database.db import get_db_connection
+from utils import vector_index
+from utils.document_listener import DocumentChangeListener, parse_notifications
+from utils.user_verify import get_db_cursor
+
+DIM = 1024
+# notification -> searchable: batch window + fetch + index update, with slack for a loaded CI box
+MAX_DELAY = 5.0
+
+
+def fake_encode(texts):
+    """Deterministic stand-in for the embedding model (titles only)"""
+    return np.stack([
+        np.random.default_rng(abs(hash(text)) % 2**32).standard_normal(DIM).astype(np.float32)
+        for text in texts
+    ])
+
+
+def random_vector(seed=None):
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+
+
+def top_ids(index, query_vec, k=3):
+    return [doc_id for doc_id, _, _, _ in index.search_rescored(query_vec, k, 20, vector_index.load_document_vectors)]
+
+
+@pytest.fixture
+def index(database, monkeypatch):
+    """An empty, already built int8 index installed as the process-wide one"""
+    idx = vector_index.QuantizedIndex("int8")
+    monkeypatch.setattr(vector_index, "_INDEX", idx)
+    return idx
+
+
+@pytest.fixture
+def insert_document(database):
+    created = []
+
+    def insert(vector, title=None):
+        with get_db_cursor() as cur:
+            cur.execute(
+                "INSERT INTO documents (title, content, embedding) VALUES (%s, %s, %s) RETURNING id",
+                (title or f"listener test {uuid.uuid4()}", "listener test content", vector)
+            )
+            doc_id = cur.fetchone()['id']
+        created.append(doc_id)
+        return doc_id
+
+    yield insert
+    with get_db_cursor() as cur:
+        cur.execute("DELETE FROM documents WHERE id = ANY(%s)", (created,))
+
+
+def test_parse_notifications_last_event_wins():
+    payloads = [
+        json.dumps({"op": "INSERT", "id": 1}),
+        json.dumps({"op": "UPDATE", "id": 2}),
+        json.dumps({"op": "DELETE", "id": 1}),
+        "not json",
+        json.dumps({"op": "INSERT", "id": 3}),
+        json.dumps({"op": "DELETE", "id": 3}),
+        json.dumps({"op": "INSERT", "id": 3}),
+    ]
+    changed, deleted = parse_notifications(payloads)
+    assert changed == {2, 3}
+    assert deleted == {1}
+
+
+def test_notification_payload_applies_to_index(index, insert_document):
+    vector = random_vector()
+    doc_id = insert_document(vector)
+    listener = DocumentChangeListener(fake_encode)
+
+    started = time.monotonic()
+    listener.apply(*parse_notifications([json.dumps({"op": "INSERT", "id": doc_id})]))
+    assert time.monotonic() - started < MAX_DELAY
+    assert top_ids(index, vector)[0] == doc_id
+
+    listener.apply(*parse_notifications([json.dumps({"op": "DELETE", "id": doc_id})]))
+    assert doc_id not in top_ids(index, vector)
+
+
+def test_notification_payload_is_retrievable(index, insert_document, monkeypatch):
+    try:
+        from utils import llm_call
+    except Exception as e:
+        pytest.skip(f"embedding model not available: {e}")
+    monkeypatch.setattr(llm_call, "RETRIEVAL_INDEX_MODE", "int8")
+    text = f"Salgyt kodeksiniň synag maddasy {uuid.uuid4()}"
+    title = f"Synag kanuny {uuid.uuid4()}"
+    doc_id = insert_document(llm_call.encode_texts([text])[0], title=title)
+
+    listener = DocumentChangeListener(llm_call.encode_texts)
+    listener.apply(*parse_notifications([json.dumps({"op": "INSERT", "id": doc_id})]))
+
+    segments = llm_call.retrieve_segments(text, top_k=3, similarity_threshold=0.0)
+    assert title in [segment_title for segment_title, _, _ in segments]
+
+
+def test_insert_becomes_retrievable_within_bounded_delay(index, insert_document):
+    listener = DocumentChangeListener(fake_encode)
+    listener.start()
+    try:
+        deadline = time.monotonic() + MAX_DELAY
+        while listener._checkpoint is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert listener._checkpoint is not None, "listener did not connect"
+
+        vector = random_vector()
+        inserted_at = time.monotonic()
+        doc_id = insert_document(vector)
+        while time.monotonic() - inserted_at < MAX_DELAY:
+            if doc_id in index.document_ids():
+                break
+            time.sleep(0.05)
+        delay = time.monotonic() - inserted_at
+        assert doc_id in index.document_ids(), f"not retrievable after {delay:.1f}s"
+        assert top_ids(index, vector)[0] == doc_id
+    finally:
+        listener.stop()
+        listener.join(timeout=5)
+
+
+class IdleListenConnection:
+    """A LISTEN connection whose socket stays quiet: its NOTIFYs were already read by an earlier query"""
+
+    def __init__(self, payloads):
+        self._read_fd, self._write_fd = os.pipe()
+        self.notifies = [SimpleNamespace(payload=payload) for payload in payloads]
+
+    def fileno(self):
+        return self._read_fd
+
+    def poll(self):
+        pass
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+def test_notifications_read_by_a_query_are_applied():
+    listener = DocumentChangeListener(fake_encode)
+    listener._checkpoint_taken = time.monotonic()
+    applied = []
+
+    def apply(changed, deleted):
+        applied.append((changed, deleted))
+        listener.stop()
+
+    listener.apply = apply
+    conn = IdleListenConnection([json.dumps({"op": "INSERT", "id": 7})])
+    thread = threading.Thread(target=listener._listen, args=(conn,), daemon=True)
+    started = time.monotonic()
+    thread.start()
+    thread.join(timeout=MAX_DELAY)
+    conn.close()
+
+    assert applied == [({7}, set())], f"not applied after {time.monotonic() - started:.1f}s"
+
+
+def test_resync_catches_up_without_rebuilding(index, insert_document):
+    listener = DocumentChangeListener(fake_encode)
+    kept_vector, removed_vector = random_vector(1), random_vector(2)
+    kept_id = insert_document(kept_vector)
+    removed_id = insert_document(removed_vector)
+    listener.apply({kept_id, removed_id}, set())
+
+    conn = get_db_connection()
+    conn.autocommit = True
+    try:
+        listener._resync(conn)  # first connect sets the checkpoint
+
+        # changes made while "disconnected": nobody is listening
+        missed_vector = random_vector(3)
+        missed_id = insert_document(missed_vector)
+        with get_db_cursor() as cur:
+            cur.execute("DELETE FROM documents WHERE id = %s", (removed_id,))
+
+        listener._resync(conn)
+    finally:
+        conn.close()
+
+    assert vector_index.get_loaded_index() is index
+    assert {kept_id, missed_id} <= index.document_ids()
+    assert removed_id not in index.document_ids()
+    assert top_ids(index, missed_vector)[0] == missed_id
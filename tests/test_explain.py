@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("fastapi")
+
+from database.db import get_db_connection
+from database.migrate import explain_hot_queries, plan_uses_index
+
+# enough rooms for one user that the planner's choice between the (user_id, created_at, id)
+# btree and the trigram index reflects what production sees
+SEED_ROOMS = 20_000
+SEED_MESSAGES = 20_000
+
+
+def index_scan(index_name, *children):
+    return {"Node Type": "Index Scan", "Index Name": index_name, "Plans": list(children)}
+
+
+def test_plan_uses_index_checks_the_named_index():
+    btree = {"Node Type": "Limit", "Plans": [index_scan("chatroom_user_created_id_live_idx")]}
+    assert plan_uses_index(btree)
+    assert not plan_uses_index(btree, "chatroom_title_trgm_idx")
+
+    trigram = {"Node Type": "Sort", "Plans": [{
+        "Node Type": "Bitmap Heap Scan",
+        "Plans": [{"Node Type": "Bitmap Index Scan", "Index Name": "chatroom_title_trgm_idx"}],
+    }]}
+    assert plan_uses_index(trigram, "chatroom_title_trgm_idx")
+    assert not plan_uses_index({"Node Type": "Seq Scan"})
+
+
+@pytest.fixture
+def seeded_conn(database):
+    """A connection whose open transaction holds a seeded user, rooms and messages; rolled back afterwards"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute("INSERT INTO users (name, password) VALUES ('explain-test', 'x') RETURNING id")
+    user_id = cur.fetchone()['id']
+    # md5 hex titles never contain the search term used by hot_queries
+    cur.execute(
+        """INSERT INTO chatroom (title, user_id, created_at)
+           SELECT 'room ' || md5(g::text), %s, now() - g * interval '1 minute'
+           FROM generate_series(1, %s) g""",
+        (user_id, SEED_ROOMS)
+    )
+    cur.execute("SELECT min(id) AS id FROM chatroom WHERE user_id = %s", (user_id,))
+    room_id = cur.fetchone()['id']
+    cur.execute(
+        """INSERT INTO chatmessage (type_user, room_id, prompt)
+           SELECT g %% 2 = 0, %s + g %% 100, 'message ' || g
+           FROM generate_series(1, %s) g""",
+        (room_id, SEED_MESSAGES)
+    )
+    cur.execute("ANALYZE users, chatroom, chatmessage")
+    cur.close()
+    try:
+        yield conn, user_id, room_id
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def test_hot_queries_use_their_indexes(seeded_conn):
+    """Every hot query scans an index, and the one it was built for where hot_queries names it
+    (the trigram index for title search, (room_id, id) for message pages, ...)"""
+    conn, user_id, room_id = seeded_conn
+    results = explain_hot_queries(conn, user_id=user_id, room_id=room_id)
+
+    assert results
+    for description, uses_index, nodes in results:
+        assert uses_index, f"{description}: {nodes}"
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import os
+import pstats
+import time
+
+import pytest
+
+pytest.importorskip("starlette")
+pytest.importorskip("fastapi")
+pytest.importorskip("pgvector")
+
+from utils import profiling
+
+RETRIEVAL_SECONDS = 0.2
+
+
+def retrieve_segments(text, top_k=3):
+    """Stand-in for utils.llm_call.retrieve_segments (which needs the embedding model): CPU work in the threadpool"""
+    deadline = time.perf_counter() + RETRIEVAL_SECONDS
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(1000))
+    return [("title", "content", 1.0)] * top_k
+
+
+async def room_query_app(scope, receive, send):
+    """Calls retrieval the way controller.chat.room_query does, then answers"""
+    await profiling.run_in_threadpool(retrieve_segments, "kanun", 3)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def profile_request(mode):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/api/v1/llm/room-query", "headers": []}
+    asyncio.run(profiling.ProfilingMiddleware(room_query_app)(scope, receive, send))
+    headers = dict(sent[0]["headers"])
+    return os.path.join(profiling.PROFILING_DIR, headers[b"x-profile-file"].decode())
+
+
+@pytest.fixture(autouse=True)
+def profiling_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_DIR", str(tmp_path))
+
+
+def test_cprofile_sees_threadpool_retrieval(monkeypatch):
+    monkeypatch.setattr(profiling, "requested_mode", lambda scope: "cprofile")
+    path = profile_request("cprofile")
+
+    functions = {name for _, _, name in pstats.Stats(path).stats}
+    assert "retrieve_segments" in functions
+
+
+def test_sampler_sees_threadpool_retrieval(monkeypatch):
+    monkeypatch.setattr(profiling, "requested_mode", lambda scope: "sampler")
+    path = profile_request("sampler")
+
+    with open(path, encoding="utf-8") as f:
+        profile = json.load(f)
+    frames = profile["shared"]["frames"]
+    sampled = {
+        frames[index]["name"]
+        for thread_profile in profile["profiles"]
+        for stack in thread_profile["samples"]
+        for index in stack
+    }
+    assert "retrieve_segments" in sampled
+    assert len(profile["profiles"]) >= 2
+
+
+def test_threadpool_call_outside_a_profiled_request_is_not_profiled():
+    assert asyncio.run(profiling.run_in_threadpool(sum, [1, 2, 3])) == 6
+    assert profiling._REQUEST_PROFILE.get() is None
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from utils.responses import CompressionMiddleware, dumps_line
+
+LINES = 50
+
+
+def make_app():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, compressor=GZipMiddleware, minimum_size=10)
+
+    async def lines():
+        for i in range(LINES):
+            yield dumps_line({"index": i, "text": "x" * 100})
+
+    @app.post("/api/v1/gpt/batch-query")
+    async def batch_query():
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.get("/api/v1/gpt/room/1/messages")
+    async def history(stream: bool = False):
+        if stream:
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+        return JSONResponse({"messages": ["x" * 100] * LINES})
+
+    return app
+
+
+def request(app, method, path, query=b""):
+    """(response start message, body chunks) for one request sent with Accept-Encoding: gzip"""
+    messages = []
+    received = []
+
+    async def receive():
+        if received:
+            # the client stays connected until the response is complete
+            await asyncio.Event().wait()
+        received.append(True)
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": query, "headers": [(b"accept-encoding", b"gzip")],
+        "client": ("127.0.0.1", 1), "server": ("testserver", 80),
+    }
+    asyncio.run(app(scope, receive, send))
+    start = next(m for m in messages if m["type"] == "http.response.start")
+    chunks = [m["body"] for m in messages if m["type"] == "http.response.body" and m.get("body")]
+    return dict(start["headers"]), chunks
+
+
+@pytest.mark.parametrize("method, path, query", [
+    ("POST", "/api/v1/gpt/batch-query", b""),
+    ("GET", "/api/v1/gpt/room/1/messages", b"stream=true&limit=50"),
+])
+def test_ndjson_streams_are_not_compressed(method, path, query):
+    headers, chunks = request(make_app(), method, path, query)
+    assert b"content-encoding" not in headers
+    assert len(chunks) == LINES
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
+
+
+def test_json_history_is_compressed():
+    headers, _ = request(make_app(), "GET", "/api/v1/gpt/room/1/messages")
+    assert headers[b"content-encoding"] == b"gzip"
@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("pgvector")
+
+from utils.room import _message_page_query, _reads_newest_first
+
+
+@pytest.mark.parametrize("before, after, limit, newest_first", [
+    (None, None, 50, True),     # opening a room: its latest page
+    (1000, None, 50, True),     # scrolling back
+    (None, 1000, 50, False),    # catching up after a known message
+    (1000, 10, 50, False),
+    (None, None, None, False),  # whole room
+])
+def test_page_direction(before, after, limit, newest_first):
+    query, params = _message_page_query(before, after, limit)
+    assert _reads_newest_first(before, after, limit) is newest_first
+    assert query.endswith("ORDER BY id DESC LIMIT %s" if newest_first else
+                          ("ORDER BY id ASC LIMIT %s" if limit else "ORDER BY id ASC"))
+    if limit is not None:
+        assert params[-1] == limit + 1
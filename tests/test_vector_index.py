@@ -0,0 +1,43 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from utils.vector_index import QuantizedIndex, hamming_distances, normalize, quantize_binary
+
+DIM = 1000  # not a multiple of 64: exercises the word padding
+
+
+def build(mode, vectors):
+    index = QuantizedIndex(mode)
+    index.add(list(range(len(vectors))), ["title"] * len(vectors), vectors,
+              lambda titles: np.ones((len(titles), vectors.shape[1]), dtype=np.float32))
+    return index
+
+
+def test_hamming_distances_count_differing_signs():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, DIM))
+    query = rng.standard_normal(DIM)
+
+    codes = quantize_binary(vectors)
+    assert codes.shape[1] % 8 == 0  # whole 64-bit words
+    expected = ((vectors > 0) != (query > 0)).sum(axis=1)
+    assert np.array_equal(hamming_distances(codes, quantize_binary(query)), expected)
+
+
+def test_int8_similarities_match_float32():
+    rng = np.random.default_rng(1)
+    vectors = normalize(rng.standard_normal((500, DIM)))
+    query = normalize(rng.standard_normal(DIM))
+
+    approx = build("int8", vectors).content_similarities(query)
+    assert np.abs(approx - vectors @ query).max() < 0.01
+
+
+def test_binary_coarse_pass_keeps_the_nearest_neighbour():
+    rng = np.random.default_rng(2)
+    vectors = normalize(rng.standard_normal((2000, DIM)))
+    query = normalize(vectors[123] + 0.3 * normalize(rng.standard_normal(DIM)))
+
+    candidates, _ = build("binary", vectors).search(query, 20)
+    assert 123 in candidates
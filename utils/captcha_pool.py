@@ -0,0 +1,135 @@
+import logging
+import multiprocessing
+import os
+import secrets
+import string
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from captcha.image import ImageCaptcha
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CAPTCHA_POOL_ENABLED = os.getenv("CAPTCHA_POOL_ENABLED", "true").lower() == "true"
+CAPTCHA_POOL_SIZE = int(os.getenv("CAPTCHA_POOL_SIZE", "200"))
+CAPTCHA_RENDER_BATCH = int(os.getenv("CAPTCHA_RENDER_BATCH", "20"))
+CAPTCHA_WIDTH = 280
+CAPTCHA_HEIGHT = 90
+CAPTCHA_LENGTH = 5
+CAPTCHA_ALPHABET = string.ascii_uppercase + string.digits
+
+
+def render_captcha() -> Tuple[str, bytes]:
+    """Random solution and its PNG image"""
+    text = ''.join(secrets.choice(CAPTCHA_ALPHABET) for _ in range(CAPTCHA_LENGTH))
+    image_captcha = ImageCaptcha(width=CAPTCHA_WIDTH, height=CAPTCHA_HEIGHT)
+    return text, image_captcha.generate(text).read()
+
+
+def render_captchas(count: int) -> List[Tuple[str, bytes]]:
+    """Runs in the renderer process"""
+    return [render_captcha() for _ in range(count)]
+
+
+class CaptchaPool:
+    """Bounded pool of pre-rendered captchas, refilled by a separate renderer process"""
+
+    def __init__(self, size: int = CAPTCHA_POOL_SIZE, batch: int = CAPTCHA_RENDER_BATCH):
+        self.size = size
+        self.batch = batch
+        self._items: deque = deque(maxlen=size)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {
+            "rendered": 0,
+            "render_seconds": 0.0,
+            "served_from_pool": 0,
+            "served_inline": 0,
+        }
+
+    def start(self) -> None:
+        # spawn, not fork: forking a threaded worker with torch loaded can deadlock the child
+        self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        self._thread = threading.Thread(target=self._refill_loop, name="captcha-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _refill_loop(self) -> None:
+        while not self._stop.is_set():
+            missing = self.size - len(self._items)
+            if missing <= 0:
+                self._wakeup.clear()
+                self._wakeup.wait(timeout=5)
+                continue
+            started = time.perf_counter()
+            try:
+                rendered = self._executor.submit(render_captchas, min(self.batch, missing)).result()
+            except Exception as e:
+                logger.error(f"Captcha renderer failed: {e}")
+                self._stop.wait(1)
+                continue
+            self.stats["render_seconds"] += time.perf_counter() - started
+            self.stats["rendered"] += len(rendered)
+            self._items.extend(rendered)
+
+    def pop(self) -> Tuple[str, bytes]:
+        """A pre-rendered captcha, or one rendered inline when the pool has run dry"""
+        try:
+            item = self._items.popleft()
+            self.stats["served_from_pool"] += 1
+        except IndexError:
+            item = render_captcha()
+            self.stats["served_inline"] += 1
+        if len(self._items) < self.size // 2:
+            self._wakeup.set()
+        return item
+
+    def get_stats(self) -> dict:
+        render_seconds = self.stats["render_seconds"]
+        return {
+            "enabled": True,
+            "occupancy": len(self._items),
+            "capacity": self.size,
+            **self.stats,
+            "render_seconds": round(render_seconds, 2),
+            "renders_per_second": round(self.stats["rendered"] / render_seconds, 1) if render_seconds else None,
+        }
+
+
+_POOL: Optional[CaptchaPool] = None
+
+
+def start_captcha_pool() -> None:
+    global _POOL
+    if CAPTCHA_POOL_ENABLED and _POOL is None:
+        _POOL = CaptchaPool()
+        _POOL.start()
+
+
+def stop_captcha_pool() -> None:
+    global _POOL
+    if _POOL is not None:
+        _POOL.stop()
+        _POOL = None
+
+
+def get_captcha_image() -> Tuple[str, bytes]:
+    """Solution and PNG for a new captcha"""
+    if _POOL is None:
+        return render_captcha()
+    return _POOL.pop()
+
+
+def get_captcha_pool_stats() -> dict:
+    return _POOL.get_stats() if _POOL is not None else {"enabled": False}
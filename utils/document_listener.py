@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+
+from database.db import get_db_connection
+from utils.user_verify import get_db_cursor
+from utils.vector_index import apply_document_changes, get_loaded_index
+from utils.embedding_snapshot import get_loaded_snapshot, get_snapshot
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Channel fed by the triggers in migrations/versions/007_documents_notify.sql
+DOCUMENTS_CHANNEL = "documents_changed"
+LISTENER_BATCH_WINDOW = float(os.getenv("DOCUMENTS_LISTENER_BATCH_WINDOW", "0.2"))
+LISTENER_RECONNECT_DELAY = float(os.getenv("DOCUMENTS_LISTENER_RECONNECT_DELAY", "5"))
+# how often the listener records the DB time up to which it has seen every change
+LISTENER_CHECKPOINT_INTERVAL = float(os.getenv("DOCUMENTS_LISTENER_CHECKPOINT_INTERVAL", "30"))
+# changes this much older than the checkpoint are re-applied too (long transactions, late notifications)
+LISTENER_RESYNC_MARGIN = float(os.getenv("DOCUMENTS_LISTENER_RESYNC_MARGIN", "60"))
+
+_INVALIDATION_CALLBACKS: List[Callable[[Set[int]], None]] = []
+LISTENER_STATS = {
+    "connected": False,
+    "events_received": 0,
+    "batches_applied": 0,
+    "documents_applied": 0,
+    "last_apply_ms": None,
+    "reconnects": 0,
+    "resync_documents": 0,
+}
+
+
+def register_invalidation_callback(callback: Callable[[Set[int]], None]) -> None:
+    """Register a cache to be invalidated with the ids of changed/deleted documents"""
+    _INVALIDATION_CALLBACKS.append(callback)
+
+
+def get_listener_stats() -> dict:
+    return dict(LISTENER_STATS)
+
+
+def parse_notifications(payloads: Iterable[str]) -> Tuple[Set[int], Set[int]]:
+    """(changed ids, deleted ids) from `documents_changed` payloads; the last event per id wins"""
+    changed: Set[int] = set()
+    deleted: Set[int] = set()
+    for payload in payloads:
+        try:
+            event = json.loads(payload)
+            doc_id = int(event["id"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed documents notification: {payload}")
+            continue
+        if event.get("op") == "DELETE":
+            deleted.add(doc_id)
+            changed.discard(doc_id)
+        else:
+            changed.add(doc_id)
+            deleted.discard(doc_id)
+    return changed, deleted
+
+
+class DocumentChangeListener(threading.Thread):
+    """Background thread that LISTENs for document changes and applies them to the in-memory views"""
+
+    def __init__(self, encode_titles: Callable, use_snapshot: bool = False):
+        super().__init__(name="documents-listener", daemon=True)
+        self.encode_titles = encode_titles
+        self.use_snapshot = use_snapshot
+        self._stop_event = threading.Event()
+        # DB time up to which every change has been applied; None before the first connect
+        self._checkpoint = None
+        self._checkpoint_taken = 0.0
+        # whether the snapshot was in sync with the DB when the connection dropped
+        self._snapshot_trusted = False
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = get_db_connection()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {DOCUMENTS_CHANNEL};")
+                LISTENER_STATS["connected"] = True
+                self._resync(conn)
+                self._listen(conn)
+            except Exception as e:
+                logger.error(f"Documents listener error: {e}")
+                LISTENER_STATS["reconnects"] += 1
+            finally:
+                LISTENER_STATS["connected"] = False
+                snapshot = get_loaded_snapshot()
+                if snapshot is not None:
+                    self._snapshot_trusted = snapshot.tracking and not snapshot._stale
+                    snapshot.stop_tracking()
+                if conn:
+                    conn.close()
+            self._stop_event.wait(LISTENER_RECONNECT_DELAY)
+
+    def _take_checkpoint(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("SELECT now() AS now")
+            now = cur.fetchone()['now']
+        self._checkpoint_taken = time.monotonic()
+        return now
+
+    def _resync(self, conn) -> None:
+        """Events sent while we were not listening are lost: re-apply what changed since the last checkpoint.
+
+        Only the missed rows are touched; the in-memory index is kept rather than rebuilt.
+        """
+        first_connect = self._checkpoint is None
+        now = self._take_checkpoint(conn)
+        since = (self._checkpoint or now) - timedelta(seconds=LISTENER_RESYNC_MARGIN)
+
+        snapshot = None
+        snapshot_trusted = False
+        if self.use_snapshot:
+            try:
+                snapshot = get_snapshot()
+                snapshot_trusted = not first_connect and self._snapshot_trusted
+                if not snapshot_trusted:
+                    snapshot.start_tracking()
+            except Exception as e:
+                logger.error(f"Embedding snapshot unavailable: {e}")
+
+        changed, deleted = missed_changes(since, snapshot)
+        if changed or deleted:
+            LISTENER_STATS["resync_documents"] += len(changed) + len(deleted)
+            self.apply(changed, deleted)
+        if snapshot_trusted:
+            snapshot.resume_tracking()
+        self._checkpoint = now
+
+    def _listen(self, conn) -> None:
+        while not self._stop_event.is_set():
+            # any query on conn (checkpoint, resync) reads pending NOTIFYs into conn.notifies,
+            # and select() does not wake up for those: handle them before waiting
+            if not conn.notifies and select.select([conn], [], [], 1.0) == ([], [], []):
+                if time.monotonic() - self._checkpoint_taken >= LISTENER_CHECKPOINT_INTERVAL:
+                    # everything notified so far has been applied; also detects a dead connection
+                    self._checkpoint = self._take_checkpoint(conn)
+                continue
+            # collect everything that arrives within the batch window into one delta
+            payloads: List[str] = []
+            deadline = time.monotonic() + LISTENER_BATCH_WINDOW
+            while True:
+                conn.poll()
+                while conn.notifies:
+                    payloads.append(conn.notifies.pop(0).payload)
+                    LISTENER_STATS["events_received"] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                select.select([conn], [], [], remaining)
+            changed, deleted = parse_notifications(payloads)
+            self.apply(changed, deleted)
+
+    def apply(self, changed: Set[int], deleted: Set[int]) -> None:
+        started = time.perf_counter()
+        applied = apply_document_changes(list(changed), list(deleted), self.encode_titles)
+
+        snapshot = get_loaded_snapshot()
+        if snapshot is not None:
+            rows = []
+            if changed:
+                with get_db_cursor() as cur:
+                    cur.execute("SELECT id, title, embedding FROM documents WHERE id = ANY(%s)", (list(changed),))
+                    rows = cur.fetchall()
+            gone = changed - {row['id'] for row in rows}
+            snapshot.apply_changes(rows, list(deleted | gone), self.encode_titles)
+            applied = max(applied, len(changed) + len(deleted))
+
+        for callback in _INVALIDATION_CALLBACKS:
+            try:
+                callback(changed | deleted)
+            except Exception as e:
+                logger.error(f"Cache invalidation callback failed: {e}")
+
+        LISTENER_STATS["batches_applied"] += 1
+        LISTENER_STATS["documents_applied"] += applied
+        LISTENER_STATS["last_apply_ms"] = round(1000 * (time.perf_counter() - started), 1)
+        logger.info(f"Applied document changes: {len(changed)} upserted, {len(deleted)} deleted")
+
+
+def missed_changes(since, snapshot=None) -> Tuple[Set[int], Set[int]]:
+    """Ids updated at or after `since`, and ids held in memory that no longer exist in the DB"""
+    held: Set[int] = set()
+    index = get_loaded_index()
+    if index is not None:
+        held |= index.document_ids()
+    if snapshot is not None:
+        held |= snapshot.document_ids()
+    with get_db_cursor() as cur:
+        cur.execute("SELECT id FROM documents WHERE updated_at >= %s", (since,))
+        changed = {row['id'] for row in cur.fetchall()}
+        deleted: Set[int] = set()
+        if held:
+            cur.execute("SELECT id FROM documents WHERE id = ANY(%s)", (list(held),))
+            deleted = held - {row['id'] for row in cur.fetchall()}
+    return changed, deleted
+
+
+_LISTENER: Optional[DocumentChangeListener] = None
+
+
+def start_document_listener(encode_titles: Callable, use_snapshot: bool = False) -> None:
+    global _LISTENER
+    if _LISTENER is None:
+        _LISTENER = DocumentChangeListener(encode_titles, use_snapshot)
+        _LISTENER.start()
+
+
+def stop_document_listener() -> None:
+    global _LISTENER
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        _LISTENER = None
@@ -0,0 +1,372 @@
+"""Memory-mapped snapshot of `documents` embeddings shared by all workers.
+
+Layout (little endian, every section 64-byte aligned):
+    header   magic, version, dim, count, unique titles, created_at,
+             DB fingerprint (documents_version) and the offset of each section below
+    content  float32[count, dim]     normalized content embeddings
+    titles   float32[titles, dim]    normalized embeddings of unique titles
+    doc_title int32[count]           row in the title matrix for each document
+    ids      int64[count]            documents.id of each row
+    title_offsets int64[titles + 1]  byte offsets into the title blob
+    title_blob                       utf-8 titles
+
+Export:
+    python -m utils.embedding_snapshot export --path /var/lib/hukuk/documents.snap
+
+Workers notice a newly exported file (inode or mtime change) and map it.
+"""
+import argparse
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.vector_index import CONTENT_WEIGHT, TITLE_WEIGHT, normalize
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = os.getenv("EMBEDDING_SNAPSHOT_PATH", "data/documents.snap")
+SNAPSHOT_CHECK_INTERVAL = int(os.getenv("EMBEDDING_SNAPSHOT_CHECK_INTERVAL", "300"))
+
+MAGIC = b"HKSNAP01"
+VERSION = 1
+HEADER_FORMAT = "<8sIIQQd64s6Q"
+HEADER_SIZE = 256
+ALIGNMENT = 64
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def db_fingerprint() -> str:
+    """Version of the `documents` table, bumped by a trigger on every change (one-row lookup)"""
+    from utils.user_verify import get_db_cursor
+
+    with get_db_cursor() as cur:
+        cur.execute("SELECT version FROM documents_version WHERE id = 1")
+        row = cur.fetchone()
+    return f"v{row['version'] if row else 0}"
+
+
+class EmbeddingSnapshot:
+    """Read-only view over a snapshot file; matrices are numpy views on the mmap, never heap copies"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.file_id = (stat.st_ino, stat.st_mtime_ns)
+        if len(self._mm) < HEADER_SIZE:
+            raise SnapshotError(f"Snapshot {path} is truncated")
+        (magic, version, self.dim, self.count, self.title_count, self.created_at, fingerprint,
+         content_off, titles_off, doc_title_off, ids_off, title_offsets_off, blob_off) = struct.unpack_from(
+            HEADER_FORMAT, self._mm, 0
+        )
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError(f"Unsupported snapshot format in {path}")
+        self.fingerprint = fingerprint.rstrip(b"\0").decode("ascii")
+
+        self.content = np.frombuffer(self._mm, np.float32, self.count * self.dim, content_off).reshape(self.count, self.dim)
+        self.title_vectors = np.frombuffer(self._mm, np.float32, self.title_count * self.dim, titles_off).reshape(self.title_count, self.dim)
+        self.doc_title_idx = np.frombuffer(self._mm, np.int32, self.count, doc_title_off)
+        self.ids = np.frombuffer(self._mm, np.int64, self.count, ids_off)
+        self._title_offsets = np.frombuffer(self._mm, np.int64, self.title_count + 1, title_offsets_off)
+        self._blob_off = blob_off
+        self._checked_at = 0.0
+        self._stale = False
+
+        # deltas from LISTEN/NOTIFY: base rows hidden by a mask, new versions kept in a small heap overlay
+        self.tracking = False
+        self._lock = threading.RLock()
+        self._deleted_ids = set()
+        self._dead_mask: Optional[np.ndarray] = None
+        self._overlay_ids = np.empty(0, dtype=np.int64)
+        self._overlay_titles: List[str] = []
+        self._overlay_content = np.empty((0, self.dim), dtype=np.float32)
+        self._overlay_title_vectors = np.empty((0, self.dim), dtype=np.float32)
+
+    def title(self, row: int) -> str:
+        """Decode the title of a document row straight from the mapped blob"""
+        t = int(self.doc_title_idx[row])
+        start = self._blob_off + int(self._title_offsets[t])
+        end = self._blob_off + int(self._title_offsets[t + 1])
+        return self._mm[start:end].decode("utf-8")
+
+    def is_stale(self) -> bool:
+        """Compare against the DB, at most once per SNAPSHOT_CHECK_INTERVAL seconds"""
+        if self.tracking:
+            # the listener verified the snapshot once and keeps the overlay in sync since
+            return self._stale
+        now = time.monotonic()
+        if self._checked_at and now - self._checked_at < SNAPSHOT_CHECK_INTERVAL:
+            return self._stale
+        self._checked_at = now
+        try:
+            self._stale = db_fingerprint() != self.fingerprint
+        except Exception as e:
+            logger.error(f"Could not check snapshot freshness: {e}")
+        if self._stale:
+            logger.warning(f"Embedding snapshot {self.path} is stale, re-run the export command")
+        return self._stale
+
+    def start_tracking(self) -> None:
+        """Called by the change listener right after LISTEN: verify once, then trust the deltas"""
+        self.tracking = False
+        self._checked_at = 0.0
+        self.is_stale()
+        self.tracking = True
+
+    def stop_tracking(self) -> None:
+        """Events may have been missed (e.g. listener reconnect); the snapshot can no longer be trusted"""
+        self.tracking = False
+        self._checked_at = 0.0
+
+    def resume_tracking(self) -> None:
+        """The listener has re-applied the changes it missed: trust the deltas again without a DB check"""
+        self.tracking = True
+
+    def document_ids(self) -> set:
+        """Ids of the documents currently searchable (base rows not hidden, plus the overlay)"""
+        with self._lock:
+            ids = set(int(i) for i in self.ids) - self._deleted_ids
+            ids.update(int(i) for i in self._overlay_ids)
+            return ids
+
+    def apply_changes(self, rows: List[dict], deleted_ids: List[int], encode_titles) -> None:
+        """Hide deleted/replaced base rows and keep the current version of changed rows in the overlay"""
+        with self._lock:
+            changed = {int(row['id']) for row in rows}
+            removed = changed | {int(i) for i in deleted_ids}
+            self._deleted_ids |= removed
+            self._dead_mask = np.isin(self.ids, np.fromiter(self._deleted_ids, dtype=np.int64))
+
+            keep = ~np.isin(self._overlay_ids, np.fromiter(removed, dtype=np.int64))
+            ids = self._overlay_ids[keep]
+            titles = [t for t, k in zip(self._overlay_titles, keep) if k]
+            content = self._overlay_content[keep]
+            title_vectors = self._overlay_title_vectors[keep]
+            if rows:
+                new_titles = [row['title'] for row in rows]
+                ids = np.concatenate([ids, np.array([row['id'] for row in rows], dtype=np.int64)])
+                titles = titles + new_titles
+                content = np.vstack([content, normalize(np.stack([np.asarray(row['embedding'], dtype=np.float32) for row in rows]))])
+                title_vectors = np.vstack([title_vectors, normalize(encode_titles(new_titles))])
+            self._overlay_ids, self._overlay_titles = ids, titles
+            self._overlay_content, self._overlay_title_vectors = content, title_vectors
+
+    def _rows_for_ids(self, allowed_ids: Sequence[int]) -> np.ndarray:
+        """Row positions of the given ids (rows are stored in id order, so this is a binary search)"""
+        wanted = np.asarray(allowed_ids, dtype=np.int64)
+        rows = np.searchsorted(self.ids, wanted)
+        found = rows < self.count
+        found[found] = self.ids[rows[found]] == wanted[found]
+        return rows[found]
+
+    def search(self, query_vec: np.ndarray, top_k: int, similarity_threshold: float = 0.0,
+               allowed_ids: Optional[Sequence[int]] = None) -> List[Tuple[int, str, float]]:
+        """Exact combined title/content search; returns (document id, title, similarity).
+
+        With allowed_ids only those rows are read and scored.
+        """
+        query_vec = normalize(query_vec)
+        with self._lock:
+            hits = []
+            rows = None if allowed_ids is None else self._rows_for_ids(allowed_ids)
+            if rows is not None and self._dead_mask is not None:
+                rows = rows[~self._dead_mask[rows]]
+            count = self.count if rows is None else len(rows)
+            if count:
+                if rows is None:
+                    sims = CONTENT_WEIGHT * (self.content @ query_vec)
+                    sims += TITLE_WEIGHT * (self.title_vectors @ query_vec)[self.doc_title_idx]
+                    if self._dead_mask is not None:
+                        sims[self._dead_mask] = -np.inf
+                else:
+                    sims = CONTENT_WEIGHT * (self.content[rows] @ query_vec)
+                    sims += TITLE_WEIGHT * (self.title_vectors @ query_vec)[self.doc_title_idx[rows]]
+                k = min(top_k, count)
+                best = np.argpartition(-sims, k - 1)[:k]
+                for i in best:
+                    row = int(i) if rows is None else int(rows[i])
+                    hits.append((int(self.ids[row]), self.title(row), float(sims[i])))
+            if len(self._overlay_ids):
+                sims = CONTENT_WEIGHT * (self._overlay_content @ query_vec)
+                sims += TITLE_WEIGHT * (self._overlay_title_vectors @ query_vec)
+                allowed = None if allowed_ids is None else set(int(i) for i in allowed_ids)
+                hits.extend(
+                    (int(doc_id), title, float(sim))
+                    for doc_id, title, sim in zip(self._overlay_ids, self._overlay_titles, sims)
+                    if allowed is None or int(doc_id) in allowed
+                )
+        hits = [hit for hit in hits if hit[2] >= similarity_threshold]
+        return sorted(hits, key=lambda x: x[2], reverse=True)[:top_k]
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+_SNAPSHOT: Optional[EmbeddingSnapshot] = None
+_SNAPSHOT_LOCK = threading.Lock()
+
+
+def _file_id(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def get_snapshot(path: str = SNAPSHOT_PATH) -> EmbeddingSnapshot:
+    """Process-wide snapshot, mapped on first use and re-mapped when the file is replaced by an export"""
+    global _SNAPSHOT
+    current = _SNAPSHOT
+    if current is not None and current.path == path:
+        file_id = _file_id(path)
+        if file_id is None or file_id == current.file_id:
+            return current
+    with _SNAPSHOT_LOCK:
+        if _SNAPSHOT is current:
+            try:
+                snapshot = EmbeddingSnapshot(path)
+            except Exception:
+                if current is None:
+                    raise
+                logger.exception(f"Could not map new embedding snapshot {path}, keeping the old one")
+                current.file_id = _file_id(path)
+                return current
+            if current is not None and current.tracking:
+                # the listener is running: verify the new file once, then keep applying deltas to it
+                snapshot.start_tracking()
+            # the old mapping is left to the GC: in-flight searches may still hold views on it
+            _SNAPSHOT = snapshot
+            logger.info(f"Mapped embedding snapshot {path}: {snapshot.count} documents")
+    return _SNAPSHOT
+
+
+def get_snapshot_stats() -> dict:
+    if _SNAPSHOT is None:
+        return {"loaded": False}
+    return {
+        "path": _SNAPSHOT.path,
+        "documents": _SNAPSHOT.count,
+        "unique_titles": _SNAPSHOT.title_count,
+        "created_at": _SNAPSHOT.created_at,
+        "stale": _SNAPSHOT._stale,
+        "tracking_changes": _SNAPSHOT.tracking,
+        "overlay_documents": len(_SNAPSHOT._overlay_ids),
+        "hidden_documents": len(_SNAPSHOT._deleted_ids),
+    }
+
+
+def get_loaded_snapshot() -> Optional[EmbeddingSnapshot]:
+    """The snapshot if it is mapped in this process, without mapping it"""
+    return _SNAPSHOT
+
+
+# -----------------------------
+# Export
+# -----------------------------
+def export_snapshot(path: str, encode_titles, batch_rows: int = 2000) -> int:
+    """Write a snapshot of `documents` to `path` (atomically, via a temp file)"""
+    from utils.user_verify import get_db_cursor, get_db_server_cursor
+
+    fingerprint = db_fingerprint()
+    with get_db_cursor() as cur:
+        cur.execute("SELECT count(*) AS n FROM documents")
+        count = cur.fetchone()['n']
+
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    ids: List[int] = []
+    doc_titles: List[str] = []
+    dim = None
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER_SIZE)
+        content_off = HEADER_SIZE
+        with get_db_server_cursor("embedding_snapshot_export", itersize=batch_rows) as cur:
+            cur.execute("SELECT id, title, embedding FROM documents ORDER BY id")
+            while True:
+                rows = cur.fetchmany(batch_rows)
+                if not rows:
+                    break
+                vectors = normalize(np.stack([np.asarray(r['embedding'], dtype=np.float32) for r in rows]))
+                dim = vectors.shape[1]
+                f.write(vectors.tobytes())
+                ids.extend(r['id'] for r in rows)
+                doc_titles.extend(r['title'] for r in rows)
+        if len(ids) != count:
+            raise SnapshotError("documents changed during export, retry")
+        dim = dim or 0
+
+        unique_titles = list(dict.fromkeys(doc_titles))
+        title_position = {t: i for i, t in enumerate(unique_titles)}
+
+        titles_off = _align(f.tell())
+        f.seek(titles_off)
+        for start in range(0, len(unique_titles), batch_rows):
+            f.write(normalize(encode_titles(unique_titles[start:start + batch_rows])).tobytes())
+
+        doc_title_off = _align(f.tell())
+        f.seek(doc_title_off)
+        f.write(np.array([title_position[t] for t in doc_titles], dtype=np.int32).tobytes())
+
+        ids_off = _align(f.tell())
+        f.seek(ids_off)
+        f.write(np.array(ids, dtype=np.int64).tobytes())
+
+        encoded = [t.encode("utf-8") for t in unique_titles]
+        title_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        title_offsets[1:] = np.cumsum([len(b) for b in encoded])
+        title_offsets_off = _align(f.tell())
+        f.seek(title_offsets_off)
+        f.write(title_offsets.tobytes())
+
+        blob_off = _align(f.tell())
+        f.seek(blob_off)
+        f.write(b"".join(encoded))
+
+        f.seek(0)
+        f.write(struct.pack(
+            HEADER_FORMAT, MAGIC, VERSION, dim, len(ids), len(unique_titles), time.time(),
+            fingerprint.encode("ascii"), content_off, titles_off, doc_title_off, ids_off,
+            title_offsets_off, blob_off,
+        ))
+        f.flush()
+        os.fsync(f.fileno())
+
+    if db_fingerprint() != fingerprint:
+        os.remove(tmp_path)
+        raise SnapshotError("documents changed during export, retry")
+    os.replace(tmp_path, path)
+    logger.info(f"Exported {len(ids)} documents ({len(unique_titles)} unique titles) to {path}")
+    return len(ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding snapshot tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_cmd = sub.add_parser("export", help="Export documents embeddings to a snapshot file")
+    export_cmd.add_argument("--path", default=SNAPSHOT_PATH)
+    check_cmd = sub.add_parser("check", help="Check a snapshot against the database")
+    check_cmd.add_argument("--path", default=SNAPSHOT_PATH)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        from utils.llm_call import encode_texts
+        export_snapshot(args.path, encode_texts)
+    else:
+        snapshot = EmbeddingSnapshot(args.path)
+        print(f"documents: {snapshot.count}, dim: {snapshot.dim}, stale: {snapshot.is_stale()}")
@@ -1,13 +1,19 @@
 import asyncio
 import aiohttp
-from typing import List,Tuple
+from typing import List,Tuple,Dict,Optional
+import hashlib
+import json
 import logging
 import os
+import time
 from fastapi import  HTTPException
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from utils.user_verify import get_db_cursor
+from utils.vector_index import get_index, load_document_vectors, normalize, INDEX_MODES, CONTENT_WEIGHT, TITLE_WEIGHT
+from utils.embedding_snapshot import get_snapshot
+from utils.document_listener import register_invalidation_callback
 try:
     model_path = Path("/home/tm/models/multilingual-e5-large")
     embed_model = SentenceTransformer(str(model_path))
@@ -20,11 +26,86 @@ logger = logging.getLogger(__name__)
 LLM_API_URL = os.getenv("LLM_API_URL", "http://localhost:1234/v1/chat/completions")
 MODEL_NAME = os.getenv("MODEL_NAME", "openai/gpt-oss-20b")
 
+# In-flight coalescing: identical concurrent requests share one upstream call
+LLM_COALESCE_ENABLED = os.getenv("LLM_COALESCE_ENABLED", "true").lower() == "true"
+LLM_COALESCE_DETERMINISTIC_ONLY = os.getenv("LLM_COALESCE_DETERMINISTIC_ONLY", "false").lower() == "true"
+
+# Retrieval: "scan" scores every row from the DB, "int8"/"binary" use the quantized in-memory index
+# (binary for speed, int8 for memory at exact-search recall; see utils/vector_index.py),
+# "snapshot" searches the memory-mapped embedding snapshot shared by all workers
+RETRIEVAL_INDEX_MODE = os.getenv("RETRIEVAL_INDEX_MODE", "scan")
+RETRIEVAL_RESCORE_CANDIDATES = int(os.getenv("RETRIEVAL_RESCORE_CANDIDATES", "50"))
+FILTER_IDS_CACHE_SIZE = 256
+# queries scored per matrix product in batch retrieval; bounds the (queries x documents) score matrix
+BATCH_RETRIEVAL_CHUNK = int(os.getenv("BATCH_RETRIEVAL_CHUNK", "64"))
+FILTER_IDS_CACHE_TTL = int(os.getenv("FILTER_IDS_CACHE_TTL", "300"))
+
 logger.info(f"LLM_API_URL: {LLM_API_URL}")
 logger.info(f"MODEL_NAME: {MODEL_NAME}")
 
+_INFLIGHT_LLM_CALLS: Dict[str, asyncio.Task] = {}
+# user-facing calls in progress; background work (room titles) waits while this is non-zero
+_ACTIVE_USER_LLM_CALLS = 0
+LLM_COALESCE_STATS = {
+    "upstream_calls": 0,
+    "coalesced_requests": 0,
+    "bypassed_requests": 0,
+}
+
+
+def llm_request_key(messages: List[dict], temperature: float, max_tokens: int) -> str:
+    """Hash of everything that determines the LLM output"""
+    raw = json.dumps(
+        {"model": MODEL_NAME, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_llm_coalesce_stats() -> dict:
+    """Counters for the in-flight coalescing layer"""
+    return {**LLM_COALESCE_STATS, "inflight": len(_INFLIGHT_LLM_CALLS), "user_inflight": _ACTIVE_USER_LLM_CALLS}
+
+
+def user_llm_calls_in_flight() -> int:
+    return _ACTIVE_USER_LLM_CALLS
+
+
+async def call_llm_api(messages: List[dict], temperature: float = 0.7, max_tokens: int = 1000, background: bool = False) -> dict:
+    """Make async call to LLM API; `background` calls are not counted as user-facing"""
+    global _ACTIVE_USER_LLM_CALLS
+    if background:
+        return await _call_llm_coalesced(messages, temperature, max_tokens)
+    _ACTIVE_USER_LLM_CALLS += 1
+    try:
+        return await _call_llm_coalesced(messages, temperature, max_tokens)
+    finally:
+        _ACTIVE_USER_LLM_CALLS -= 1
 
-async def call_llm_api(messages: List[dict], temperature: float = 0.7, max_tokens: int = 1000) -> dict:
+
+async def _call_llm_coalesced(messages: List[dict], temperature: float, max_tokens: int) -> dict:
+    """Share the result between identical concurrent requests"""
+    if not LLM_COALESCE_ENABLED or (LLM_COALESCE_DETERMINISTIC_ONLY and temperature != 0):
+        LLM_COALESCE_STATS["bypassed_requests"] += 1
+        LLM_COALESCE_STATS["upstream_calls"] += 1
+        return await _post_llm_request(messages, temperature, max_tokens)
+
+    key = llm_request_key(messages, temperature, max_tokens)
+    task = _INFLIGHT_LLM_CALLS.get(key)
+    if task is not None:
+        LLM_COALESCE_STATS["coalesced_requests"] += 1
+        logger.info(f"Coalescing LLM request {key[:12]} onto in-flight call")
+    else:
+        LLM_COALESCE_STATS["upstream_calls"] += 1
+        task = asyncio.ensure_future(_post_llm_request(messages, temperature, max_tokens))
+        _INFLIGHT_LLM_CALLS[key] = task
+        task.add_done_callback(lambda _: _INFLIGHT_LLM_CALLS.pop(key, None))
+    # shield: one waiter being cancelled must not cancel the call for the others
+    return await asyncio.shield(task)
+
+
+async def _post_llm_request(messages: List[dict], temperature: float, max_tokens: int) -> dict:
     """Make async call to LLM API"""
     payload = {
         "model": MODEL_NAME,
@@ -58,12 +139,82 @@ def cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
     return np.dot(a, b) / (norm_a * norm_b)
 
 
-def retrieve_segments(text: str, top_k: int = 3, similarity_threshold: float = 0.3) -> List[Tuple[str, str, float]]:
-    """Retrieve top-k most similar document segments based on combined title and content similarity"""
+# -----------------------------
+# Metadata filters
+# -----------------------------
+_FILTER_IDS_CACHE: Dict[tuple, Tuple[float, np.ndarray]] = {}
+register_invalidation_callback(lambda _ids: _FILTER_IDS_CACHE.clear())
+
+
+def document_filter_clause(filters) -> Tuple[str, list]:
+    """SQL condition (without WHERE) and params for a DocumentFilters, or ("", []) when unfiltered.
+
+    Every filter needs its metadata column set: rows without metadata only match
+    unfiltered queries (migrations/versions/009_documents_metadata.sql).
+    """
+    if filters is None:
+        return "", []
+    clauses, params = [], []
+    if filters.code_ids:
+        clauses.append("code_id = ANY(%s)")
+        params.append(list(filters.code_ids))
+    if filters.article_numbers:
+        clauses.append("article_number = ANY(%s)")
+        params.append(list(filters.article_numbers))
+    if filters.effective_on:
+        clauses.append("effective_date <= %s")
+        params.append(filters.effective_on)
+    return " AND ".join(clauses), params
+
+
+def resolve_filter_ids(filters) -> Optional[np.ndarray]:
+    """Sorted ids of the documents matching the filters (cached), or None when unfiltered"""
+    clause, params = document_filter_clause(filters)
+    if not clause:
+        return None
+    key = (tuple(filters.code_ids or ()), tuple(filters.article_numbers or ()), filters.effective_on)
+    cached = _FILTER_IDS_CACHE.get(key)
+    if cached is not None and time.monotonic() - cached[0] < FILTER_IDS_CACHE_TTL:
+        return cached[1]
+    with get_db_cursor() as cur:
+        cur.execute(f"SELECT id FROM documents WHERE {clause} ORDER BY id", tuple(params))
+        ids = np.array([row['id'] for row in cur.fetchall()], dtype=np.int64)
+    if len(_FILTER_IDS_CACHE) >= FILTER_IDS_CACHE_SIZE:
+        _FILTER_IDS_CACHE.pop(next(iter(_FILTER_IDS_CACHE)))
+    _FILTER_IDS_CACHE[key] = (time.monotonic(), ids)
+    return ids
+
+
+def encode_texts(texts: List[str]) -> np.ndarray:
+    """Batch-encode texts with the embedding model"""
+    return embed_model.encode(texts, batch_size=64).astype(np.float32)
+
+
+def retrieve_segments(text: str, top_k: int = 3, similarity_threshold: float = 0.3, filters=None) -> List[Tuple[str, str, float]]:
+    """Retrieve top-k most similar document segments based on combined title and content similarity.
+
+    `filters` (DocumentFilters) limits the search to the matching documents only.
+    """
+    if RETRIEVAL_INDEX_MODE in INDEX_MODES:
+        # None while the index is still being built in the background: scan meanwhile
+        index = get_index(RETRIEVAL_INDEX_MODE, encode_texts)
+        if index is not None:
+            return retrieve_segments_indexed(index, text, top_k, similarity_threshold, filters)
+    if RETRIEVAL_INDEX_MODE == "snapshot":
+        try:
+            snapshot = get_snapshot()
+            if not snapshot.is_stale():
+                return retrieve_segments_snapshot(snapshot, text, top_k, similarity_threshold, filters)
+        except Exception as e:
+            logger.error(f"Embedding snapshot unavailable, falling back to scan: {e}")
     try:
         query_vec = embed_model.encode([text])[0].astype(np.float32)
+        clause, params = document_filter_clause(filters)
         with get_db_cursor() as cur:
-            cur.execute("SELECT title, content, embedding FROM documents")
+            if clause:
+                cur.execute(f"SELECT title, content, embedding FROM documents WHERE {clause}", tuple(params))
+            else:
+                cur.execute("SELECT title, content, embedding FROM documents")
             rows = cur.fetchall()
             if not rows:
                 logger.warning("No documents found in database")
@@ -76,7 +227,7 @@ def retrieve_segments(text: str, top_k: int = 3, similarity_threshold: float = 0
                     title_emb_array = embed_model.encode([row['title']])[0].astype(np.float32)
                     content_sim = cosine_sim(query_vec, content_emb_array)
                     title_sim = cosine_sim(query_vec, title_emb_array)
-                    combined_sim = 0.7 * content_sim + 0.3 * title_sim
+                    combined_sim = CONTENT_WEIGHT * content_sim + TITLE_WEIGHT * title_sim
                     if combined_sim >= similarity_threshold:
                         sims.append((row['title'], row['content'], combined_sim))
                 except Exception as e:
@@ -90,4 +241,108 @@ def retrieve_segments(text: str, top_k: int = 3, similarity_threshold: float = 0
             return sorted(sims, key=lambda x: x[2], reverse=True)[:top_k]
     except Exception as e:
         logger.error(f"Error in retrieve_segments: {e}")
-        return []
\ No newline at end of file
+        return []
+
+
+def retrieve_segments_indexed(index, text: str, top_k: int = 3, similarity_threshold: float = 0.3, filters=None) -> List[Tuple[str, str, float]]:
+    """Quantized coarse pass over the in-memory index, exact rescoring of the top candidates"""
+    try:
+        query_vec = embed_model.encode([text])[0].astype(np.float32)
+        results = index.search_rescored(
+            query_vec, top_k, RETRIEVAL_RESCORE_CANDIDATES, load_document_vectors, similarity_threshold,
+            allowed_ids=resolve_filter_ids(filters)
+        )
+        if not results:
+            logger.info(f"No relevant segments found above threshold {similarity_threshold}")
+        return [(title, content, sim) for _, title, content, sim in results]
+    except Exception as e:
+        logger.error(f"Error in retrieve_segments_indexed: {e}")
+        return []
+
+
+def retrieve_segments_snapshot(snapshot, text: str, top_k: int = 3, similarity_threshold: float = 0.3, filters=None) -> List[Tuple[str, str, float]]:
+    """Exact search over the mmap snapshot; only the winning rows' content is read from the DB"""
+    query_vec = embed_model.encode([text])[0].astype(np.float32)
+    hits = snapshot.search(query_vec, top_k, similarity_threshold, allowed_ids=resolve_filter_ids(filters))
+    if not hits:
+        logger.info(f"No relevant segments found above threshold {similarity_threshold}")
+        return []
+    with get_db_cursor() as cur:
+        cur.execute("SELECT id, content FROM documents WHERE id = ANY(%s)", ([doc_id for doc_id, _, _ in hits],))
+        contents = {row['id']: row['content'] for row in cur.fetchall()}
+    return [
+        (title, contents[doc_id], sim)
+        for doc_id, title, sim in hits
+        if doc_id in contents
+    ]
+
+
+def retrieve_segments_batch(texts: List[str], top_k: int = 3, similarity_threshold: float = 0.3, filters=None) -> List[List[Tuple[str, str, float]]]:
+    """Retrieval for many queries at once: one batched encode, then matrix scoring against the corpus.
+
+    Returns one segment list per input text, in order.
+    """
+    if not texts:
+        return []
+    query_matrix = normalize(encode_texts(texts))
+    allowed_ids = resolve_filter_ids(filters)
+
+    index = get_index(RETRIEVAL_INDEX_MODE, encode_texts) if RETRIEVAL_INDEX_MODE in INDEX_MODES else None
+    if index is not None:
+        return [
+            [(title, content, sim) for _, title, content, sim in index.search_rescored(
+                query_vec, top_k, RETRIEVAL_RESCORE_CANDIDATES, load_document_vectors, similarity_threshold,
+                allowed_ids=allowed_ids
+            )]
+            for query_vec in query_matrix
+        ]
+
+    if RETRIEVAL_INDEX_MODE == "snapshot":
+        try:
+            snapshot = get_snapshot()
+            if not snapshot.is_stale():
+                hits = [snapshot.search(query_vec, top_k, similarity_threshold, allowed_ids=allowed_ids) for query_vec in query_matrix]
+                wanted = list({doc_id for query_hits in hits for doc_id, _, _ in query_hits})
+                with get_db_cursor() as cur:
+                    cur.execute("SELECT id, content FROM documents WHERE id = ANY(%s)", (wanted,))
+                    contents = {row['id']: row['content'] for row in cur.fetchall()}
+                return [
+                    [(title, contents[doc_id], sim) for doc_id, title, sim in query_hits if doc_id in contents]
+                    for query_hits in hits
+                ]
+        except Exception as e:
+            logger.error(f"Embedding snapshot unavailable, falling back to scan: {e}")
+
+    clause, params = document_filter_clause(filters)
+    with get_db_cursor() as cur:
+        if clause:
+            cur.execute(f"SELECT title, content, embedding FROM documents WHERE {clause}", tuple(params))
+        else:
+            cur.execute("SELECT title, content, embedding FROM documents")
+        rows = cur.fetchall()
+    if not rows:
+        logger.warning("No documents found in database")
+        return [[] for _ in texts]
+
+    titles = [row['title'] for row in rows]
+    contents = [row['content'] for row in rows]
+    content_matrix = normalize(np.stack([np.asarray(row['embedding'], dtype=np.float32) for row in rows]))
+    unique_titles = list(dict.fromkeys(titles))
+    title_position = {title: i for i, title in enumerate(unique_titles)}
+    title_rows = np.array([title_position[title] for title in titles])
+    title_matrix = normalize(encode_texts(unique_titles))
+
+    k = min(top_k, len(rows))
+    results = []
+    for start in range(0, len(texts), BATCH_RETRIEVAL_CHUNK):
+        queries = query_matrix[start:start + BATCH_RETRIEVAL_CHUNK]
+        sims = CONTENT_WEIGHT * (queries @ content_matrix.T) + TITLE_WEIGHT * (queries @ title_matrix.T)[:, title_rows]
+        best = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        for query_sims, candidates in zip(sims, best):
+            hits = [
+                (titles[i], contents[i], float(query_sims[i]))
+                for i in candidates
+                if query_sims[i] >= similarity_threshold
+            ]
+            results.append(sorted(hits, key=lambda x: x[2], reverse=True))
+    return results
@@ -0,0 +1,313 @@
+"""Per-request profiling for admins.
+
+A request is profiled when an admin sends `X-Profile: cprofile|sampler|1`, or
+when it is picked by PROFILING_SAMPLE_RATE. cProfile writes a pstats `.prof`
+file (open with `python -m pstats` or snakeviz); the sampler records the
+stacks every PROFILING_SAMPLER_INTERVAL seconds and writes a speedscope
+`.speedscope.json` file (open at https://www.speedscope.app), one profile per
+thread.
+
+Both modes observe the event loop thread and every threadpool call the request
+makes through this module's run_in_threadpool: the middleware stores the
+request's profile in a contextvar, which starlette carries into the worker
+thread, and the worker profiles itself while the call runs. Work of other
+requests interleaved at an `await` on the event loop shows up as well.
+
+The middleware is only installed when PROFILING_ENABLED is set, so a disabled
+profiler costs nothing per request.
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from starlette import concurrency
+
+from utils.jwt import decode_token
+from utils.user_verify import is_admin
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_DIR = os.getenv("PROFILING_DIR", "data/profiles")
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "50"))
+# fraction of all requests profiled without the header, with PROFILING_MODE
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_MODE = os.getenv("PROFILING_MODE", "cprofile")
+PROFILING_SAMPLER_INTERVAL = float(os.getenv("PROFILING_SAMPLER_INTERVAL", "0.005"))
+PROFILE_HEADER = b"x-profile"
+PROFILE_MODES = ("cprofile", "sampler")
+PROFILE_FILE_PATTERN = re.compile(r"^[\w.-]+\.(prof|speedscope\.json)$")
+
+PROFILING_STATS = {"profiled": 0, "skipped_busy": 0, "files_deleted": 0, "errors": 0}
+# only one cProfile profiler can be active per process
+_CPROFILE_ACTIVE = False
+
+
+class StackSampler(threading.Thread):
+    """Samples the Python stacks of the watched threads at a fixed interval"""
+
+    def __init__(self, thread_id: int, interval: float = PROFILING_SAMPLER_INTERVAL):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.interval = interval
+        self.frames: List[dict] = []
+        self.samples: Dict[int, List[List[int]]] = {}
+        self.weights: Dict[int, List[float]] = {}
+        self.thread_names: Dict[int, str] = {}
+        self._watched = set()
+        self._frame_index = {}
+        self._stop_event = threading.Event()
+        self.watch(thread_id, "event loop")
+
+    def watch(self, thread_id: int, name: str) -> None:
+        self.thread_names.setdefault(thread_id, name)
+        self._watched.add(thread_id)
+
+    def unwatch(self, thread_id: int) -> None:
+        self._watched.discard(thread_id)
+
+    def run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            current = sys._current_frames()
+            now = time.perf_counter()
+            for thread_id in list(self._watched):
+                frame = current.get(thread_id)
+                if frame is not None:
+                    self.samples.setdefault(thread_id, []).append(self._stack(frame))
+                    self.weights.setdefault(thread_id, []).append(now - last)
+            last = now
+
+    def _stack(self, frame) -> List[int]:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            index = self._frame_index.get(key)
+            if index is None:
+                index = self._frame_index[key] = len(self.frames)
+                self.frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def to_speedscope(self, name: str) -> dict:
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "utils.profiling",
+            "shared": {"frames": self.frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": f"{name} [{self.thread_names[thread_id]}]",
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(self.weights[thread_id]),
+                    "samples": samples,
+                    "weights": self.weights[thread_id],
+                }
+                for thread_id, samples in self.samples.items()
+            ],
+        }
+
+
+class RequestProfile:
+    """Profilers of one request: the event loop's, plus one per profiled threadpool call"""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.sampler: Optional[StackSampler] = None
+        self.thread_profilers: List[cProfile.Profile] = []
+
+
+_REQUEST_PROFILE: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+
+def _call_profiled(func, *args, **kwargs):
+    """Run func in this worker thread, profiled for the request that submitted it"""
+    profile = _REQUEST_PROFILE.get()
+    if profile is None:
+        return func(*args, **kwargs)
+
+    if profile.sampler is not None:
+        thread_id = threading.get_ident()
+        profile.sampler.watch(thread_id, threading.current_thread().name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.sampler.unwatch(thread_id)
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ cProfile is built on sys.monitoring: the request's profiler
+        # is the one active tool and already sees this thread
+        return func(*args, **kwargs)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profile.thread_profilers.append(profiler)
+
+
+async def run_in_threadpool(func, *args, **kwargs):
+    """starlette's run_in_threadpool; the call is profiled when its request is"""
+    return await concurrency.run_in_threadpool(_call_profiled, func, *args, **kwargs)
+
+
+def requested_mode(scope: dict) -> Optional[str]:
+    """Profiling mode for this request, or None"""
+    headers = dict(scope.get("headers") or [])
+    value = headers.get(PROFILE_HEADER)
+    if value is not None:
+        mode = value.decode("latin-1").strip().lower()
+        mode = PROFILING_MODE if mode in ("1", "true") else mode
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        if mode in PROFILE_MODES and authorization.lower().startswith("bearer "):
+            payload = decode_token(authorization[7:].strip(), token_type="access")
+            if payload is not None and is_admin(payload):
+                return mode
+    if PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE:
+        return PROFILING_MODE
+    return None
+
+
+def profile_file_name(scope: dict, mode: str) -> str:
+    slug = re.sub(r"[^\w-]+", "_", scope.get("path", "")).strip("_")[:60] or "root"
+    suffix = "prof" if mode == "cprofile" else "speedscope.json"
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}-{scope.get('method', 'GET')}-{slug}.{suffix}"
+
+
+def enforce_retention(max_files: int = PROFILING_MAX_FILES) -> None:
+    """Delete the oldest profiles beyond max_files"""
+    profiles = list_profiles()
+    for profile in profiles[max_files:]:
+        try:
+            os.remove(os.path.join(PROFILING_DIR, profile["name"]))
+            PROFILING_STATS["files_deleted"] += 1
+        except OSError:
+            pass
+
+
+def list_profiles() -> List[dict]:
+    """Saved profiles, newest first"""
+    if not os.path.isdir(PROFILING_DIR):
+        return []
+    profiles = []
+    for entry in os.scandir(PROFILING_DIR):
+        if entry.is_file() and PROFILE_FILE_PATTERN.match(entry.name):
+            stat = entry.stat()
+            profiles.append({"name": entry.name, "size": stat.st_size, "modified": stat.st_mtime})
+    return sorted(profiles, key=lambda p: p["modified"], reverse=True)
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Path of a saved profile, or None for unknown / malformed names"""
+    if not PROFILE_FILE_PATTERN.match(name):
+        return None
+    path = os.path.join(PROFILING_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def _save_cprofile(profiler: cProfile.Profile, thread_profilers: List[cProfile.Profile], path: str) -> None:
+    os.makedirs(PROFILING_DIR, exist_ok=True)
+    stats = pstats.Stats(profiler)
+    for thread_profiler in thread_profilers:
+        stats.add(thread_profiler)
+    stats.dump_stats(path)
+    enforce_retention()
+
+
+def _save_speedscope(sampler: StackSampler, path: str, name: str) -> None:
+    os.makedirs(PROFILING_DIR, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(sampler.to_speedscope(name), f)
+    enforce_retention()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles selected requests and saves the result to PROFILING_DIR"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        mode = requested_mode(scope)
+        if mode is None:
+            return await self.app(scope, receive, send)
+
+        global _CPROFILE_ACTIVE
+        if mode == "cprofile" and _CPROFILE_ACTIVE:
+            PROFILING_STATS["skipped_busy"] += 1
+            return await self.app(scope, receive, send)
+
+        name = profile_file_name(scope, mode)
+        path = os.path.join(PROFILING_DIR, name)
+
+        async def send_with_header(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-file", name.encode())]
+            await send(message)
+
+        profile = RequestProfile(mode)
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            _CPROFILE_ACTIVE = True
+            token = _REQUEST_PROFILE.set(profile)
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_with_header)
+            finally:
+                profiler.disable()
+                _REQUEST_PROFILE.reset(token)
+                _CPROFILE_ACTIVE = False
+                await self._save(_save_cprofile, path, profiler, profile.thread_profilers, path)
+        else:
+            profile.sampler = StackSampler(threading.get_ident())
+            profile.sampler.start()
+            token = _REQUEST_PROFILE.set(profile)
+            try:
+                await self.app(scope, receive, send_with_header)
+            finally:
+                _REQUEST_PROFILE.reset(token)
+                profile.sampler.stop()
+                await self._save(
+                    _save_speedscope, path, profile.sampler, path, f"{scope.get('method')} {scope.get('path')}"
+                )
+
+    async def _save(self, save, path: str, *args) -> None:
+        try:
+            await concurrency.run_in_threadpool(save, *args)
+            PROFILING_STATS["profiled"] += 1
+            logger.info(f"Saved request profile {path}")
+        except Exception as e:
+            PROFILING_STATS["errors"] += 1
+            logger.error(f"Could not save request profile: {e}")
+
+
+def get_profiling_stats() -> dict:
+    return {
+        "enabled": PROFILING_ENABLED,
+        "sample_rate": PROFILING_SAMPLE_RATE,
+        "mode": PROFILING_MODE,
+        **PROFILING_STATS,
+    }
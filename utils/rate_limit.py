@@ -0,0 +1,182 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Tuple
+
+from fastapi import Depends, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# "memory" is per worker process; "redis" shares the buckets between workers
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+MEMORY_BACKEND_MAX_KEYS = 100_000
+
+# Per-route limits as "capacity/seconds": a bucket of `capacity` tokens refilled over `seconds`.
+# Override with RATE_LIMIT_<ROUTE>, e.g. RATE_LIMIT_ROOM_QUERY=20/60
+DEFAULT_LIMITS = {
+    "room_query": "10/60",
+    "batch_query": "2/300",
+    "login": "10/60",
+    "captcha": "30/60",
+}
+
+
+def parse_limit(value: str) -> Tuple[float, float]:
+    """"10/60" -> (capacity 10, refill 10/60 tokens per second)"""
+    capacity, seconds = value.split("/")
+    return float(capacity), float(capacity) / float(seconds)
+
+
+@lru_cache(maxsize=None)
+def route_limit(route: str) -> Tuple[float, float]:
+    return parse_limit(os.getenv(f"RATE_LIMIT_{route.upper()}", DEFAULT_LIMITS.get(route, "60/60")))
+
+
+class MemoryBackend:
+    """Token buckets in an LRU-ordered dict, guarded by a lock"""
+
+    def __init__(self, max_keys: int = MEMORY_BACKEND_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, refill_rate: float) -> float:
+        """Consume one token; returns 0 if allowed, otherwise seconds until a token is available"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    # least recently used key goes first; O(1) instead of scanning every bucket
+                    self._buckets.popitem(last=False)
+                bucket = self._buckets[key] = [capacity, now]
+            else:
+                self._buckets.move_to_end(key)
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / refill_rate
+
+
+class RedisBackend:
+    """Token buckets in Redis, updated atomically by a Lua script"""
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url: str = RATE_LIMIT_REDIS_URL):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def take(self, key: str, capacity: float, refill_rate: float) -> float:
+        return float(self._script(keys=[f"ratelimit:{key}"], args=[capacity, refill_rate, time.time()]))
+
+
+_BACKEND = None
+RATE_LIMIT_STATS = {"checks": 0, "rejected": 0, "backend_errors": 0, "total_ns": 0}
+
+
+def get_backend():
+    global _BACKEND
+    if _BACKEND is None:
+        _BACKEND = RedisBackend() if RATE_LIMIT_BACKEND == "redis" else MemoryBackend()
+    return _BACKEND
+
+
+def check_rate_limit(route: str, key: str) -> None:
+    """Raise 429 with Retry-After when the bucket for (route, key) is empty"""
+    if not RATE_LIMIT_ENABLED:
+        return
+    started = time.perf_counter_ns()
+    capacity, refill_rate = route_limit(route)
+    try:
+        wait = get_backend().take(f"{route}:{key}", capacity, refill_rate)
+    except Exception as e:
+        # a broken shared backend must not take the API down with it
+        RATE_LIMIT_STATS["backend_errors"] += 1
+        logger.error(f"Rate limit backend error: {e}")
+        wait = 0.0
+    RATE_LIMIT_STATS["checks"] += 1
+    RATE_LIMIT_STATS["total_ns"] += time.perf_counter_ns() - started
+    if wait > 0:
+        RATE_LIMIT_STATS["rejected"] += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))}
+        )
+
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def check_rate_limit_async(route: str, key: str) -> None:
+    """check_rate_limit for async dependencies; the Redis round trip runs off the event loop"""
+    if RATE_LIMIT_BACKEND == "redis":
+        await run_in_threadpool(check_rate_limit, route, key)
+    else:
+        check_rate_limit(route, key)
+
+
+def rate_limit_by_ip(route: str):
+    """Dependency limiting a route per client IP"""
+    async def dependency(request: Request):
+        await check_rate_limit_async(route, client_ip(request))
+    return dependency
+
+
+def rate_limit_by_user(route: str):
+    """Dependency limiting a route per authenticated user (JWT user_id)"""
+    # imported here: utils.user_verify imports routers.users, which uses rate_limit_by_ip
+    from utils.user_verify import get_current_user
+
+    async def dependency(current_user: dict = Depends(get_current_user)):
+        await check_rate_limit_async(route, str(current_user.get("user_id")))
+    return dependency
+
+
+def get_rate_limit_stats() -> dict:
+    checks = RATE_LIMIT_STATS["checks"]
+    return {
+        "enabled": RATE_LIMIT_ENABLED,
+        "backend": RATE_LIMIT_BACKEND,
+        "checks": checks,
+        "rejected": RATE_LIMIT_STATS["rejected"],
+        "backend_errors": RATE_LIMIT_STATS["backend_errors"],
+        "avg_overhead_us": round(RATE_LIMIT_STATS["total_ns"] / checks / 1000, 2) if checks else None,
+    }
@@ -0,0 +1,47 @@
+import json
+from typing import Any
+from urllib.parse import parse_qs
+
+from fastapi.responses import JSONResponse
+
+# orjson is optional: several times faster for the large answer/segment payloads
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:
+    orjson = None
+    FastJSONResponse = JSONResponse
+
+
+def dumps_line(obj: Any) -> bytes:
+    """Serialize one NDJSON line"""
+    if orjson is not None:
+        return orjson.dumps(obj) + b"\n"
+    return (json.dumps(obj, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+# responses streamed as NDJSON: gzip/brotli buffer each chunk in the compressor,
+# so lines would reach the client in bursts instead of as they are produced
+NDJSON_STREAM_PATH_SUFFIXES = ("/batch-query",)
+TRUE_QUERY_VALUES = {"1", "true", "yes", "on"}
+
+
+def is_ndjson_stream(scope: dict) -> bool:
+    """Whether the request is answered with an NDJSON stream (batch query, ?stream=true history)"""
+    if scope.get("path", "").endswith(NDJSON_STREAM_PATH_SUFFIXES):
+        return True
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return any(value.lower() in TRUE_QUERY_VALUES for value in query.get("stream", []))
+
+
+class CompressionMiddleware:
+    """Compresses responses with the given middleware class, except NDJSON streams"""
+
+    def __init__(self, app, compressor, **options):
+        self.app = app
+        self.compressed = compressor(app, **options)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and is_ndjson_stream(scope):
+            return await self.app(scope, receive, send)
+        return await self.compressed(scope, receive, send)
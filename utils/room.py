@@ -1,72 +1,110 @@
-from utils.user_verify import verify_room_ownership,get_db_cursor
-from typing import List,Optional
+from utils.user_verify import verify_room_ownership,get_db_cursor,get_db_server_cursor
+from utils.responses import dumps_line
+from typing import List,Optional,Iterator,Tuple
+import base64
+import json
 
-def get_room_messages(room_id: int, user_id: int) -> List[dict]:
-    """Retrieve all messages for a specific room if user owns it"""
-    try:
-        if not verify_room_ownership(room_id, user_id):
-            return []
-        
-        with get_db_cursor() as cur:
-            cur.execute(
-                """SELECT cm.id, cm.type_user, cm.room_id, cm.prompt, cm.created_at,
-                          cr.title, cr.user_id as room_owner_id
-                   FROM chatmessage cm
-                   JOIN chatroom cr ON cm.room_id = cr.id
-                   WHERE cm.room_id = %s
-                   ORDER BY cm.created_at ASC;""",
-                (room_id,)
-            )
-            rows = cur.fetchall()
-            
-            messages = []
-            room_info = {}
-            
-            for row in rows:
-                message = {
-                    "id": row['id'],
-                    "type_user": row['type_user'],
-                    "room_id": row['room_id'],
-                    "prompt": row['prompt'],
-                    "created_at": row['created_at'].isoformat()
-                }
-                messages.append(message)
-                
-                if not room_info:
-                    room_info = {
-                        "room_id": row['room_id'],
-                        "title": row['title'],
-                        "owner_id": row['room_owner_id']
-                    }
-            
-            return {"messages": messages, "room_info": room_info}
-    except Exception as e:
-        return {"messages": [], "room_info": {}}
-    
+ROOM_OWNERSHIP_QUERY = "SELECT id, title, user_id FROM chatroom WHERE id = %s AND user_id = %s AND deleted_at IS NULL"
+PREVIOUS_MESSAGES_QUERY = "SELECT type_user, prompt FROM chatmessage WHERE room_id = %s ORDER BY id ASC"
 
-from utils.llm_call import call_llm_api
+def _reads_newest_first(before: Optional[int], after: Optional[int], limit: Optional[int]) -> bool:
+    """A limited page without `after` is the latest one (before `before`, if given)"""
+    return after is None and limit is not None
 
+def _message_page_query(before: Optional[int], after: Optional[int], limit: Optional[int]) -> Tuple[str, list]:
+    """SQL for a page of a room's messages, served by the (room_id, id) index"""
+    query = "SELECT id, type_user, room_id, prompt, created_at FROM chatmessage WHERE room_id = %s"
+    params = []
+    if before is not None:
+        query += " AND id < %s"
+        params.append(before)
+    if after is not None:
+        query += " AND id > %s"
+        params.append(after)
+    # the latest page (ending at `before`, if given) reads newest-first; callers reverse it (see _reads_newest_first)
+    query += " ORDER BY id DESC" if _reads_newest_first(before, after, limit) else " ORDER BY id ASC"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit + 1)
+    return query, params
+
+def _fetch_owned_room(cur, room_id: int, user_id: int) -> Optional[dict]:
+    """Ownership check and room info in one query"""
+    cur.execute(ROOM_OWNERSHIP_QUERY, (room_id, user_id))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return {"room_id": row['id'], "title": row['title'], "owner_id": row['user_id']}
+
+def get_room_info(room_id: int, user_id: int) -> Optional[dict]:
+    """Room info if the user owns the room, otherwise None"""
+    with get_db_cursor() as cur:
+        return _fetch_owned_room(cur, room_id, user_id)
+
+def get_room_messages(
+    room_id: int,
+    user_id: int,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: Optional[int] = None
+) -> Optional[dict]:
+    """Retrieve a page of messages (all of them without limit) for a room the user owns.
+
+    Returns None if the room does not exist or belongs to someone else.
+    """
+    with get_db_cursor() as cur:
+        room_info = _fetch_owned_room(cur, room_id, user_id)
+        if room_info is None:
+            return None
+
+        query, params = _message_page_query(before, after, limit)
+        cur.execute(query, (room_id, *params))
+        rows = cur.fetchall()
+
+    has_more = limit is not None and len(rows) > limit
+    rows = rows[:limit] if limit is not None else rows
+    if _reads_newest_first(before, after, limit):
+        rows.reverse()
+    for row in rows:
+        row['created_at'] = row['created_at'].isoformat()
+
+    return {
+        "messages": rows,
+        "room_info": room_info,
+        "has_more": has_more
+    }
+
+def iter_room_messages_ndjson(room_id: int, before: Optional[int] = None, after: Optional[int] = None) -> Iterator[bytes]:
+    """Stream a room's messages (oldest first) as NDJSON through a server-side cursor; ownership must be checked first"""
+    query, params = _message_page_query(before, after, None)
+    with get_db_server_cursor(f"room_messages_{room_id}", itersize=500) as cur:
+        cur.execute(query, (room_id, *params))
+        for row in cur:
+            row['created_at'] = row['created_at'].isoformat()
+            yield dumps_line(row)
+
+
+async def request_room_title(prompt: str, background: bool = False) -> str:
+    """Ask the LLM for a short room title; raises when the call fails or returns nothing"""
+    # imported here so the query builders above can be used without loading the embedding model
+    from utils.llm_call import call_llm_api
+
+    messages = [
+        {
+            "role": "system",
+            "content": "Siz Turkmence jogap berýän kömekçi modelsiňiz. Berlen soragdan gysga we manyly otag ady dörediň (maksimum 50 simwol)."
+        },
+        {
+            "role": "user",
+            "content": f"Sorag: {prompt}\n\nBu sorag üçin gysga bir title dörediň."
+        }
+    ]
+    response = await call_llm_api(messages, temperature=0.8, max_tokens=50, background=background)
+    title = response.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+    if not title:
+        raise ValueError("LLM returned an empty title")
+    return title[:50]
 
-async def generate_room_title(prompt: str) -> str:
-    """Generate a room title using the LLM based on the user prompt"""
-    try:
-        messages = [
-            {
-                "role": "system",
-                "content": "Siz Turkmence jogap berýän kömekçi modelsiňiz. Berlen soragdan gysga we manyly otag ady dörediň (maksimum 50 simwol)."
-            },
-            {
-                "role": "user",
-                "content": f"Sorag: {prompt}\n\nBu sorag üçin gysga bir title dörediň."
-            }
-        ]
-        response = await call_llm_api(messages, temperature=0.8, max_tokens=50)
-        title = response.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
-        if not title:
-            return prompt[:50]
-        return title[:50]
-    except Exception as e:
-        return prompt[:50]
 
 def create_room(title: str, user_id: Optional[int] = None) -> Optional[int]:
     """Create a new chatroom with the given title and user_id"""
@@ -86,30 +124,67 @@ def create_room(title: str, user_id: Optional[int] = None) -> Optional[int]:
 from typing import List, Optional
 from typing import Optional, List, Dict
 
+def encode_room_cursor(created_at: str, room_id: int) -> str:
+    """Opaque cursor pointing after the given (created_at, id) position"""
+    raw = json.dumps([created_at, room_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_room_cursor(cursor: str) -> Tuple[str, int]:
+    """Inverse of encode_room_cursor; raises ValueError for malformed cursors"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, room_id = json.loads(raw)
+        return str(created_at), int(room_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def _user_rooms_query(
+    user_id: int,
+    search: Optional[str],
+    limit: int,
+    offset: int,
+    after: Optional[Tuple[str, int]]
+) -> Tuple[str, tuple]:
+    """SQL for a page of a user's live rooms; keyset pages when `after` is given"""
+    query = """
+        SELECT id, title, user_id, created_at 
+        FROM chatroom 
+        WHERE user_id = %s AND deleted_at IS NULL
+    """
+    params = [user_id]
+
+    if search:
+        # served by the pg_trgm index on title
+        query += " AND title ILIKE %s"
+        params.append(f"%{search}%")
+
+    if after:
+        query += " AND (created_at, id) < (%s, %s)"
+        params.extend(after)
+        query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+        params.append(limit + 1)
+    else:
+        query += " ORDER BY created_at DESC, id DESC LIMIT %s OFFSET %s"
+        params.extend([limit + 1, offset])
+    return query, tuple(params)
+
 def get_user_rooms(
     user_id: int,
     search: Optional[str] = None,
     limit: int = 20,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None
 ) -> Dict:
-    """Retrieve user's chatrooms with optional title search, pagination and has_next info"""
+    """Retrieve user's chatrooms with optional title search, pagination and has_next info.
+
+    With a cursor (keyset pagination on created_at, id) deep pages cost the same as
+    the first one; offset is kept for existing clients.
+    """
+    after = decode_room_cursor(cursor) if cursor else None
     try:
         with get_db_cursor() as cur:
-            query = """
-                SELECT id, title, user_id, created_at 
-                FROM chatroom 
-                WHERE user_id = %s
-            """
-            params = [user_id]
-
-            if search:
-                query += " AND title ILIKE %s"
-                params.append(f"%{search}%")
-
-            query += " ORDER BY created_at DESC LIMIT %s OFFSET %s"
-            params.extend([limit + 1, offset])
-
-            cur.execute(query, tuple(params))
+            query, params = _user_rooms_query(user_id, search, limit, offset, after)
+            cur.execute(query, params)
             rows = cur.fetchall()
 
             has_next = len(rows) > limit
@@ -123,9 +198,14 @@ def get_user_rooms(
                 for row in rows[:limit]
             ]
 
+            next_cursor = None
+            if has_next and rooms:
+                next_cursor = encode_room_cursor(rooms[-1]["created_at"], rooms[-1]["id"])
+
             return {
                 "rooms": rooms,
-                "has_next": has_next
+                "has_next": has_next,
+                "next_cursor": next_cursor
             }
     except Exception as e:
-        return {"rooms": [], "has_next": False}
+        return {"rooms": [], "has_next": False, "next_cursor": None}
@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+from utils.user_verify import get_db_cursor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROOM_PURGE_ENABLED = os.getenv("ROOM_PURGE_ENABLED", "true").lower() == "true"
+# messages deleted per transaction; keeps each purge step's locks short
+ROOM_PURGE_BATCH_SIZE = int(os.getenv("ROOM_PURGE_BATCH_SIZE", "1000"))
+# pause between batches so purging never saturates the database
+ROOM_PURGE_BATCH_PAUSE = float(os.getenv("ROOM_PURGE_BATCH_PAUSE", "0.05"))
+ROOM_PURGE_IDLE_INTERVAL = float(os.getenv("ROOM_PURGE_IDLE_INTERVAL", "10"))
+
+JOB_FIELDS = """id, user_id, status, rooms_total, rooms_purged, messages_purged,
+                created_from, created_to, error, created_at, finished_at"""
+
+
+def _job_to_dict(row: dict) -> dict:
+    job = dict(row)
+    for key in ("created_from", "created_to", "created_at", "finished_at"):
+        if job[key] is not None:
+            job[key] = job[key].isoformat()
+    return job
+
+
+def schedule_room_deletion(
+    user_id: int,
+    room_ids: Optional[List[int]] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None
+) -> Optional[dict]:
+    """Hide the matching rooms right away and create a job that purges them in the background.
+
+    Returns None when no live room of the user matches.
+    """
+    with get_db_cursor() as cur:
+        cur.execute(
+            "INSERT INTO room_deletion_job (user_id, created_from, created_to) VALUES (%s, %s, %s) RETURNING id",
+            (user_id, created_from, created_to)
+        )
+        job_id = cur.fetchone()['id']
+
+        query = """UPDATE chatroom SET deleted_at = now(), deletion_job_id = %s
+                   WHERE user_id = %s AND deleted_at IS NULL"""
+        params = [job_id, user_id]
+        if room_ids is not None:
+            query += " AND id = ANY(%s)"
+            params.append(list(room_ids))
+        if created_from is not None:
+            query += " AND created_at >= %s"
+            params.append(created_from)
+        if created_to is not None:
+            query += " AND created_at < %s"
+            params.append(created_to)
+        cur.execute(query, tuple(params))
+        rooms_total = cur.rowcount
+
+        if rooms_total == 0:
+            cur.connection.rollback()
+            return None
+
+        cur.execute(
+            f"UPDATE room_deletion_job SET rooms_total = %s WHERE id = %s RETURNING {JOB_FIELDS}",
+            (rooms_total, job_id)
+        )
+        job = _job_to_dict(cur.fetchone())
+
+    if _PURGER is not None:
+        _PURGER.wake()
+    return job
+
+
+def get_deletion_job(job_id: int, user_id: int) -> Optional[dict]:
+    with get_db_cursor() as cur:
+        cur.execute(f"SELECT {JOB_FIELDS} FROM room_deletion_job WHERE id = %s AND user_id = %s", (job_id, user_id))
+        row = cur.fetchone()
+    return _job_to_dict(row) if row else None
+
+
+def purge_step(batch_size: int = ROOM_PURGE_BATCH_SIZE) -> bool:
+    """Purge one batch of the oldest open job; returns False when there is nothing to do.
+
+    FOR UPDATE SKIP LOCKED lets purgers in several workers share the jobs.
+    """
+    with get_db_cursor() as cur:
+        cur.execute(
+            """SELECT id FROM room_deletion_job
+               WHERE status IN ('pending', 'running')
+               ORDER BY id LIMIT 1
+               FOR UPDATE SKIP LOCKED"""
+        )
+        row = cur.fetchone()
+        if row is None:
+            return False
+        job_id = row['id']
+
+        cur.execute(
+            """DELETE FROM chatmessage WHERE id IN (
+                   SELECT cm.id FROM chatmessage cm
+                   JOIN chatroom cr ON cm.room_id = cr.id
+                   WHERE cr.deletion_job_id = %s
+                   LIMIT %s)""",
+            (job_id, batch_size)
+        )
+        messages = cur.rowcount
+
+        if messages < batch_size:
+            # rooms are empty now, remove them and close the job
+            cur.execute("DELETE FROM chatroom WHERE deletion_job_id = %s", (job_id,))
+            cur.execute(
+                """UPDATE room_deletion_job
+                   SET status = 'done', messages_purged = messages_purged + %s,
+                       rooms_purged = rooms_purged + %s, finished_at = now()
+                   WHERE id = %s""",
+                (messages, cur.rowcount, job_id)
+            )
+            logger.info(f"Room deletion job {job_id} finished")
+        else:
+            cur.execute(
+                """UPDATE room_deletion_job
+                   SET status = 'running', messages_purged = messages_purged + %s
+                   WHERE id = %s""",
+                (messages, job_id)
+            )
+    return True
+
+
+def get_open_job_count() -> int:
+    with get_db_cursor() as cur:
+        cur.execute("SELECT count(*) AS n FROM room_deletion_job WHERE status IN ('pending', 'running')")
+        return cur.fetchone()['n']
+
+
+class RoomPurger(threading.Thread):
+    """Background thread that works through deletion jobs in bounded batches"""
+
+    def __init__(self):
+        super().__init__(name="room-purger", daemon=True)
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self.batches = 0
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wakeup.set()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                worked = purge_step()
+            except Exception as e:
+                logger.error(f"Room purge step failed: {e}")
+                worked = False
+            if worked:
+                self.batches += 1
+                self._stop_event.wait(ROOM_PURGE_BATCH_PAUSE)
+            else:
+                self._wakeup.wait(ROOM_PURGE_IDLE_INTERVAL)
+                self._wakeup.clear()
+
+
+_PURGER: Optional[RoomPurger] = None
+
+
+def start_room_purger() -> None:
+    global _PURGER
+    if ROOM_PURGE_ENABLED and _PURGER is None:
+        _PURGER = RoomPurger()
+        _PURGER.start()
+
+
+def stop_room_purger() -> None:
+    global _PURGER
+    if _PURGER is not None:
+        _PURGER.stop()
+        _PURGER = None
+
+
+def get_room_purger_stats() -> dict:
+    stats = {"enabled": _PURGER is not None, "batches": _PURGER.batches if _PURGER else 0}
+    try:
+        stats["open_jobs"] = get_open_job_count()
+    except Exception as e:
+        logger.error(f"Could not count open deletion jobs: {e}")
+    return stats
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+from starlette.concurrency import run_in_threadpool
+
+from utils.user_verify import get_db_cursor
+from utils.llm_call import user_llm_calls_in_flight
+from utils.room import request_room_title
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ROOM_TITLES_ENABLED = os.getenv("ROOM_TITLES_ENABLED", "true").lower() == "true"
+# rooms waiting for a title beyond this keep their truncated-prompt title
+ROOM_TITLE_QUEUE_SIZE = int(os.getenv("ROOM_TITLE_QUEUE_SIZE", "1000"))
+ROOM_TITLE_BATCH_SIZE = int(os.getenv("ROOM_TITLE_BATCH_SIZE", "20"))
+ROOM_TITLE_FLUSH_INTERVAL = float(os.getenv("ROOM_TITLE_FLUSH_INTERVAL", "2"))
+ROOM_TITLE_MAX_ATTEMPTS = int(os.getenv("ROOM_TITLE_MAX_ATTEMPTS", "3"))
+ROOM_TITLE_RETRY_DELAY = float(os.getenv("ROOM_TITLE_RETRY_DELAY", "10"))
+# low priority: wait while user-facing LLM calls run, but at most this long per title
+ROOM_TITLE_MAX_DEFER = float(os.getenv("ROOM_TITLE_MAX_DEFER", "60"))
+ROOM_TITLE_IDLE_POLL = 0.2
+
+
+@dataclass
+class TitleJob:
+    room_id: int
+    prompt: str
+    attempts: int = 0
+
+
+def update_room_titles(updates: List[Tuple[int, str]]) -> int:
+    """Set the titles of several rooms in one statement"""
+    with get_db_cursor() as cur:
+        execute_values(
+            cur,
+            """UPDATE chatroom AS c SET title = v.title
+               FROM (VALUES %s) AS v(id, title)
+               WHERE c.id = v.id AND c.deleted_at IS NULL""",
+            updates,
+            page_size=max(len(updates), 1)
+        )
+        return cur.rowcount
+
+
+class RoomTitleWorker:
+    """Generates LLM room titles on the event loop, behind user-facing LLM calls"""
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=ROOM_TITLE_QUEUE_SIZE)
+        self._pending: List[Tuple[int, str]] = []
+        self._last_flush = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "generated": 0,
+            "retried": 0,
+            "failed": 0,
+            "updated": 0,
+            "batches": 0,
+        }
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def enqueue(self, job: TitleJob) -> bool:
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            return False
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                job = await asyncio.wait_for(self.queue.get(), timeout=ROOM_TITLE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                job = None
+            if job is not None:
+                await self._wait_for_idle()
+                await self._generate(job)
+            if self._pending and (
+                len(self._pending) >= ROOM_TITLE_BATCH_SIZE
+                or self.queue.empty()
+                or time.monotonic() - self._last_flush >= ROOM_TITLE_FLUSH_INTERVAL
+            ):
+                await self._flush()
+
+    async def _wait_for_idle(self) -> None:
+        deadline = time.monotonic() + ROOM_TITLE_MAX_DEFER
+        while user_llm_calls_in_flight() > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(ROOM_TITLE_IDLE_POLL)
+
+    async def _generate(self, job: TitleJob) -> None:
+        job.attempts += 1
+        try:
+            title = await request_room_title(job.prompt, background=True)
+        except Exception as e:
+            if job.attempts >= ROOM_TITLE_MAX_ATTEMPTS:
+                self.stats["failed"] += 1
+                logger.error(f"Giving up on title for room {job.room_id}: {e}")
+                return
+            self.stats["retried"] += 1
+            asyncio.get_running_loop().call_later(ROOM_TITLE_RETRY_DELAY * job.attempts, self.enqueue, job)
+            return
+        self.stats["generated"] += 1
+        self._pending.append((job.room_id, title))
+
+    async def _flush(self) -> None:
+        updates, self._pending = self._pending, []
+        self._last_flush = time.monotonic()
+        try:
+            self.stats["updated"] += await run_in_threadpool(update_room_titles, updates)
+            self.stats["batches"] += 1
+        except Exception as e:
+            logger.error(f"Could not update {len(updates)} room titles: {e}")
+            # keep them for the next flush, but never grow without bound
+            self._pending = (updates + self._pending)[-ROOM_TITLE_QUEUE_SIZE:]
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": True,
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": ROOM_TITLE_QUEUE_SIZE,
+            "pending_updates": len(self._pending),
+            **self.stats,
+        }
+
+
+_WORKER: Optional[RoomTitleWorker] = None
+
+
+def start_room_title_worker() -> None:
+    """Must be called from the event loop (app startup)"""
+    global _WORKER
+    if ROOM_TITLES_ENABLED and _WORKER is None:
+        _WORKER = RoomTitleWorker()
+        _WORKER.start()
+
+
+def stop_room_title_worker() -> None:
+    global _WORKER
+    if _WORKER is not None:
+        _WORKER.stop()
+        _WORKER = None
+
+
+def enqueue_room_title(room_id: int, prompt: str) -> bool:
+    """Queue a room for an LLM-generated title; False when disabled or the queue is full"""
+    if _WORKER is None:
+        return False
+    _WORKER.stats["enqueued"] += 1
+    return _WORKER.enqueue(TitleJob(room_id, prompt))
+
+
+def get_room_title_stats() -> dict:
+    return _WORKER.get_stats() if _WORKER is not None else {"enabled": False}
@@ -2,12 +2,17 @@ from database.db import get_db_connection
 from pgvector.psycopg2 import register_vector
 from contextlib import contextmanager
 import logging
+import os
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import HTTPException, Depends
 from routers.users import decode_token
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+
+# user ids allowed to use the admin endpoints (profiling), comma separated
+ADMIN_USER_IDS = {int(i) for i in os.getenv("ADMIN_USER_IDS", "").split(",") if i.strip()}
+
 @contextmanager
 def get_db_cursor():
     """Context manager for database connections with cursor"""
@@ -28,11 +33,33 @@ def get_db_cursor():
             conn.close()
 
 
+@contextmanager
+def get_db_server_cursor(name: str, itersize: int = 2000):
+    """Context manager for a named (server-side) cursor that streams rows instead of loading them all"""
+    conn = None
+    try:
+        conn = get_db_connection()
+        register_vector(conn)
+        cur = conn.cursor(name=name)
+        cur.itersize = itersize
+        yield cur
+        cur.close()
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Database connection error: {e}")
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+
 def verify_room_ownership(room_id: int, user_id: int) -> bool:
     """Verify if the user owns the specified room"""
     try:
         with get_db_cursor() as cur:
-            cur.execute("SELECT user_id FROM chatroom WHERE id = %s", (room_id,))
+            cur.execute("SELECT user_id FROM chatroom WHERE id = %s AND deleted_at IS NULL", (room_id,))
             result = cur.fetchone()
             if result is None:
                 return False
@@ -52,4 +79,15 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
         raise HTTPException(status_code=401, detail="Invalid or expired access token")
     if "user_id" not in payload:
         raise HTTPException(status_code=401, detail="Token does not contain user_id")
-    return payload
\ No newline at end of file
+    return payload
+
+
+def is_admin(payload: dict) -> bool:
+    return payload.get("user_id") in ADMIN_USER_IDS
+
+
+def require_admin(current_user: dict = Depends(get_current_user)):
+    """Like get_current_user, but only for the users listed in ADMIN_USER_IDS"""
+    if not is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
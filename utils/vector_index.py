@@ -0,0 +1,496 @@
+"""Compact in-memory index over `documents` embeddings.
+
+Content vectors are stored int8- or binary-quantized for the coarse pass;
+only the top-M candidates are rescored with the full-precision vectors,
+which are loaded on demand. Title vectors are de-duplicated and kept in
+float32, so the rescored similarity is exact in both terms.
+
+"binary" is the speed mode: Hamming distances over 64-bit words are several
+times cheaper than a float32 BLAS scan, at a small recall cost. "int8" is a
+memory mode: ~6.5x smaller than float32 with exact-search recall, but numpy
+has no SIMD int8 kernels, so its int32-accumulated coarse pass is slower
+than the float32 scan it replaces.
+
+The index is built in a background thread (start_index_build); until it is
+ready get_index returns None and retrieval uses the scan path.
+
+Benchmark (memory per document and recall@k against exact search):
+    python -m utils.vector_index --mode int8 --k 3 --queries 200
+    python -m utils.vector_index --mode int8 --synthetic 50000   # no DB / model needed
+"""
+import argparse
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CONTENT_WEIGHT = 0.7
+TITLE_WEIGHT = 0.3
+SCAN_CHUNK_ROWS = 8192
+COMPACT_DEAD_RATIO = 0.2
+# a failed background build is retried on a later query, but not more often than this
+INDEX_BUILD_RETRY_DELAY = 30.0
+INDEX_MODES = ("int8", "binary")
+
+# binary codes are padded to whole 64-bit words so Hamming distance runs on uint64
+BINARY_WORD_BITS = 64
+# np.bitwise_count is numpy >= 2.0; older numpy uses a per-byte popcount table
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so that cosine similarity becomes a dot product"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization; returns codes and the scale of each row"""
+    vectors = normalize(vectors)
+    max_abs = np.abs(vectors).max(axis=-1)
+    max_abs[max_abs == 0] = 1.0
+    scales = (127.0 / max_abs).astype(np.float32)
+    codes = np.round(vectors * scales[..., None]).astype(np.int8)
+    return codes, scales
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    """Sign bits packed 8 per byte, zero-padded to whole 64-bit words"""
+    bits = np.asarray(vectors) > 0
+    padding = -bits.shape[-1] % BINARY_WORD_BITS
+    if padding:
+        bits = np.concatenate([bits, np.zeros(bits.shape[:-1] + (padding,), dtype=bool)], axis=-1)
+    return np.packbits(bits, axis=-1)
+
+
+def hamming_distances(codes: np.ndarray, query_bits: np.ndarray) -> np.ndarray:
+    """Hamming distance of each row of packed codes to the packed query"""
+    if hasattr(np, "bitwise_count"):
+        words = np.ascontiguousarray(codes).view(np.uint64)
+        return np.bitwise_count(words ^ query_bits.view(np.uint64)).sum(axis=-1, dtype=np.int32)
+    return _POPCOUNT[np.bitwise_xor(codes, query_bits)].sum(axis=-1, dtype=np.int32)
+
+
+class QuantizedIndex:
+    """Quantized content vectors + float32 title vectors (titles are de-duplicated)"""
+
+    def __init__(self, mode: str = "int8"):
+        if mode not in INDEX_MODES:
+            raise ValueError(f"Unknown index mode: {mode}")
+        self.mode = mode
+        self.dim = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.content_codes = None
+        self.content_scales = np.empty(0, dtype=np.float32)
+        self.title_vectors = None
+        self.doc_title_idx = np.empty(0, dtype=np.int32)
+        self.live = np.empty(0, dtype=bool)
+        self.titles: List[str] = []
+        self._title_lookup: Dict[str, int] = {}
+        self._row_by_id: Dict[int, int] = {}
+        # incremental updates arrive from the LISTEN/NOTIFY thread
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._row_by_id)
+
+    def add(self, ids: Sequence[int], titles: Sequence[str], content_vecs: np.ndarray,
+            encode_titles: Callable[[List[str]], np.ndarray]) -> None:
+        """Append or replace documents; title embeddings are computed once per unique title"""
+        with self._lock:
+            self._add(ids, titles, content_vecs, encode_titles)
+
+    def document_ids(self) -> set:
+        """Ids of the live documents"""
+        with self._lock:
+            return set(self._row_by_id)
+
+    def remove(self, ids: Sequence[int]) -> int:
+        """Tombstone documents by id; returns how many were present"""
+        with self._lock:
+            removed = 0
+            for doc_id in ids:
+                row = self._row_by_id.pop(int(doc_id), None)
+                if row is not None:
+                    self.live[row] = False
+                    removed += 1
+            self._maybe_compact()
+            return removed
+
+    def _add(self, ids: Sequence[int], titles: Sequence[str], content_vecs: np.ndarray,
+             encode_titles: Callable[[List[str]], np.ndarray]) -> None:
+        content_vecs = np.asarray(content_vecs, dtype=np.float32)
+        self.dim = content_vecs.shape[1]
+
+        new_titles = [t for t in dict.fromkeys(titles) if t not in self._title_lookup]
+        if new_titles:
+            vectors = normalize(encode_titles(new_titles))
+            for title in new_titles:
+                self._title_lookup[title] = len(self.titles)
+                self.titles.append(title)
+            self.title_vectors = vectors if self.title_vectors is None else np.vstack([self.title_vectors, vectors])
+
+        if self.mode == "int8":
+            codes, scales = quantize_int8(content_vecs)
+            self.content_scales = np.concatenate([self.content_scales, scales])
+        else:
+            codes = quantize_binary(content_vecs)
+        self.content_codes = codes if self.content_codes is None else np.vstack([self.content_codes, codes])
+        first_row = len(self.ids)
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self.doc_title_idx = np.concatenate([
+            self.doc_title_idx,
+            np.array([self._title_lookup[t] for t in titles], dtype=np.int32),
+        ])
+        self.live = np.concatenate([self.live, np.ones(len(ids), dtype=bool)])
+        for offset, doc_id in enumerate(ids):
+            old_row = self._row_by_id.get(int(doc_id))
+            if old_row is not None:
+                self.live[old_row] = False
+            self._row_by_id[int(doc_id)] = first_row + offset
+        self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        """Drop tombstoned rows once they make up a noticeable share of the index"""
+        dead = len(self.ids) - len(self._row_by_id)
+        if not dead or dead < COMPACT_DEAD_RATIO * len(self.ids):
+            return
+        keep = self.live
+        self.ids = self.ids[keep]
+        self.content_codes = self.content_codes[keep]
+        if self.mode == "int8":
+            self.content_scales = self.content_scales[keep]
+        self.doc_title_idx = self.doc_title_idx[keep]
+        self.live = np.ones(len(self.ids), dtype=bool)
+        self._row_by_id = {int(doc_id): row for row, doc_id in enumerate(self.ids)}
+
+    def title_similarities(self, query_vec: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query to every unique title"""
+        if self.title_vectors is None:
+            return np.empty(0, dtype=np.float32)
+        return self.title_vectors @ query_vec
+
+    def content_similarities(self, query_vec: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Approximate cosine similarity of the query to every document's content (or only `rows`)"""
+        total = len(self.ids) if rows is None else len(rows)
+        sims = np.empty(total, dtype=np.float32)
+        if self.mode == "int8":
+            query_codes, query_scale = quantize_int8(query_vec[None, :])
+            query_codes, query_scale = query_codes[0], query_scale[0]
+        else:
+            query_bits = quantize_binary(query_vec)
+        for start in range(0, total, SCAN_CHUNK_ROWS):
+            end = start + SCAN_CHUNK_ROWS
+            chunk = slice(start, end) if rows is None else rows[start:end]
+            if self.mode == "int8":
+                # int8 x int8 accumulated in int32: the codes are never widened to float32
+                dots = np.einsum("ij,j->i", self.content_codes[chunk], query_codes, dtype=np.int32)
+                sims[start:end] = dots / (self.content_scales[chunk] * query_scale)
+            else:
+                hamming = hamming_distances(self.content_codes[chunk], query_bits)
+                # sign-random-projection estimate of the angle between the vectors
+                sims[start:end] = np.cos(np.pi * hamming / self.dim)
+        return sims
+
+    def search(self, query_vec: np.ndarray, top_m: int,
+               allowed_ids: Optional[Sequence[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Coarse pass: return document ids of the top-M candidates and their title similarities.
+
+        With allowed_ids only those documents are scored, so a filtered search costs
+        time proportional to the size of the subset.
+        """
+        with self._lock:
+            if allowed_ids is None:
+                rows = np.flatnonzero(self.live) if len(self) < len(self.ids) else None
+            else:
+                rows = np.fromiter(
+                    (self._row_by_id[i] for i in allowed_ids if i in self._row_by_id), dtype=np.int64
+                )
+            count = len(self) if rows is None else len(rows)
+            if not count:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            query_vec = normalize(query_vec)
+            title_rows = self.doc_title_idx if rows is None else self.doc_title_idx[rows]
+            title_sims = self.title_similarities(query_vec)[title_rows]
+            combined = CONTENT_WEIGHT * self.content_similarities(query_vec, rows) + TITLE_WEIGHT * title_sims
+            top_m = min(top_m, count)
+            candidates = np.argpartition(-combined, top_m - 1)[:top_m]
+            candidate_rows = candidates if rows is None else rows[candidates]
+            return self.ids[candidate_rows], title_sims[candidates]
+
+    def search_rescored(self, query_vec: np.ndarray, top_k: int, top_m: int,
+                        load_vectors: Callable[[List[int]], Dict[int, Tuple[str, str, np.ndarray]]],
+                        similarity_threshold: float = 0.0,
+                        allowed_ids: Optional[Sequence[int]] = None) -> List[Tuple[int, str, str, float]]:
+        """Two-stage search: quantized coarse pass, then exact float32 rescoring of the candidates"""
+        query_vec = normalize(query_vec)
+        candidates, title_sims = self.search(query_vec, max(top_m, top_k), allowed_ids)
+        if not len(candidates):
+            return []
+        candidate_ids = [int(i) for i in candidates]
+        loaded = load_vectors(candidate_ids)
+
+        results = []
+        for doc_id, title_sim in zip(candidate_ids, title_sims):
+            if doc_id not in loaded:
+                continue
+            title, content, vector = loaded[doc_id]
+            content_sim = float(normalize(vector) @ query_vec)
+            combined_sim = CONTENT_WEIGHT * content_sim + TITLE_WEIGHT * float(title_sim)
+            if combined_sim >= similarity_threshold:
+                results.append((doc_id, title, content, combined_sim))
+        return sorted(results, key=lambda x: x[3], reverse=True)[:top_k]
+
+    def memory_stats(self) -> dict:
+        """Bytes held by the index, total and per document"""
+        arrays = [self.ids, self.content_codes, self.content_scales, self.title_vectors,
+                  self.doc_title_idx, self.live]
+        vector_bytes = sum(a.nbytes for a in arrays if a is not None)
+        title_bytes = sum(len(t.encode("utf-8")) for t in self.titles)
+        count = max(len(self), 1)
+        return {
+            "mode": self.mode,
+            "documents": len(self),
+            "unique_titles": len(self.titles),
+            "index_bytes": vector_bytes + title_bytes,
+            "bytes_per_document": round((vector_bytes + title_bytes) / count, 1),
+            "float32_bytes_per_document": 2 * 4 * self.dim,
+        }
+
+
+def build_index_from_db(mode: str, encode_titles: Callable[[List[str]], np.ndarray],
+                        batch_rows: int = 2000) -> QuantizedIndex:
+    """Stream `documents` with a server-side cursor and quantize them batch by batch"""
+    from utils.user_verify import get_db_server_cursor
+
+    index = QuantizedIndex(mode)
+    started = time.perf_counter()
+    with get_db_server_cursor("vector_index_build", itersize=batch_rows) as cur:
+        cur.execute("SELECT id, title, embedding FROM documents ORDER BY id")
+        while True:
+            rows = cur.fetchmany(batch_rows)
+            if not rows:
+                break
+            index.add(
+                [row['id'] for row in rows],
+                [row['title'] for row in rows],
+                np.stack([np.asarray(row['embedding'], dtype=np.float32) for row in rows]),
+                encode_titles,
+            )
+    logger.info(f"Built {mode} index over {len(index)} documents in {time.perf_counter() - started:.1f}s "
+                f"({index.memory_stats()['bytes_per_document']} bytes/doc)")
+    return index
+
+
+def load_document_vectors(ids: List[int]) -> Dict[int, Tuple[str, str, np.ndarray]]:
+    """Fetch full-precision content embeddings (with title and content) for the given ids"""
+    from utils.user_verify import get_db_cursor
+
+    with get_db_cursor() as cur:
+        cur.execute("SELECT id, title, content, embedding FROM documents WHERE id = ANY(%s)", (list(ids),))
+        return {
+            row['id']: (row['title'], row['content'], np.asarray(row['embedding'], dtype=np.float32))
+            for row in cur.fetchall()
+        }
+
+
+_INDEX: Optional[QuantizedIndex] = None
+# held while the index is built or changed, so deltas wait for a build in progress
+_INDEX_LOCK = threading.Lock()
+_BUILD_STATE_LOCK = threading.Lock()
+_BUILD_THREAD: Optional[threading.Thread] = None
+_BUILD_FAILED_AT = 0.0
+
+
+def _build_index(mode: str, encode_titles: Callable[[List[str]], np.ndarray]) -> None:
+    global _INDEX, _BUILD_FAILED_AT
+    try:
+        with _INDEX_LOCK:
+            _INDEX = build_index_from_db(mode, encode_titles)
+    except Exception as e:
+        _BUILD_FAILED_AT = time.monotonic()
+        logger.error(f"Building the {mode} index failed: {e}")
+
+
+def start_index_build(mode: str, encode_titles: Callable[[List[str]], np.ndarray]) -> None:
+    """Build the process-wide index in a background thread (no-op if it is ready or being built)"""
+    global _BUILD_THREAD
+    with _BUILD_STATE_LOCK:
+        if _INDEX is not None and _INDEX.mode == mode:
+            return
+        if _BUILD_THREAD is not None and _BUILD_THREAD.is_alive():
+            return
+        _BUILD_THREAD = threading.Thread(
+            target=_build_index, args=(mode, encode_titles), name="vector-index-build", daemon=True
+        )
+        _BUILD_THREAD.start()
+
+
+def get_index(mode: str, encode_titles: Callable[[List[str]], np.ndarray]) -> Optional[QuantizedIndex]:
+    """The ready index, or None while it is being built (the build is started if needed).
+
+    Never builds inline: callers fall back to the scan path instead of blocking the request.
+    """
+    index = _INDEX
+    if index is not None and index.mode == mode:
+        return index
+    if time.monotonic() - _BUILD_FAILED_AT >= INDEX_BUILD_RETRY_DELAY:
+        start_index_build(mode, encode_titles)
+    return None
+
+
+def get_loaded_index() -> Optional[QuantizedIndex]:
+    """The index if it has been built in this process, without triggering a build"""
+    return _INDEX
+
+
+def apply_document_changes(changed_ids: Sequence[int], deleted_ids: Sequence[int],
+                           encode_titles: Callable[[List[str]], np.ndarray]) -> int:
+    """Apply inserted/updated/deleted documents to the loaded index; a no-op if none is built yet"""
+    from utils.user_verify import get_db_cursor
+
+    # holding the build lock means a build in progress finishes before the delta is applied
+    with _INDEX_LOCK:
+        index = _INDEX
+        if index is None:
+            return 0
+        applied = index.remove(deleted_ids) if deleted_ids else 0
+        if changed_ids:
+            with get_db_cursor() as cur:
+                cur.execute("SELECT id, title, embedding FROM documents WHERE id = ANY(%s)", (list(changed_ids),))
+                rows = cur.fetchall()
+            gone = set(changed_ids) - {row['id'] for row in rows}
+            if gone:
+                applied += index.remove(list(gone))
+            if rows:
+                index.add(
+                    [row['id'] for row in rows],
+                    [row['title'] for row in rows],
+                    np.stack([np.asarray(row['embedding'], dtype=np.float32) for row in rows]),
+                    encode_titles,
+                )
+                applied += len(rows)
+        return applied
+
+
+def get_index_stats() -> dict:
+    """Memory numbers of the loaded index, if any"""
+    building = _BUILD_THREAD is not None and _BUILD_THREAD.is_alive()
+    if _INDEX is None:
+        return {"loaded": False, "building": building}
+    return {**_INDEX.memory_stats(), "building": building}
+
+
+# -----------------------------
+# Benchmark
+# -----------------------------
+def _load_benchmark_corpus(num_queries: int):
+    """Documents and sample queries from the DB, embedded with the production model"""
+    from utils.llm_call import embed_model
+    from utils.user_verify import get_db_server_cursor
+
+    def encode(texts: List[str]) -> np.ndarray:
+        return embed_model.encode(texts, batch_size=64).astype(np.float32)
+
+    ids, titles, contents, vectors, codes = [], [], [], [], []
+    with get_db_server_cursor("vector_index_bench") as cur:
+        cur.execute("SELECT id, title, content, embedding, code_id FROM documents ORDER BY id")
+        for row in cur:
+            ids.append(row['id'])
+            codes.append(row['code_id'])
+            titles.append(row['title'])
+            contents.append(row['content'])
+            vectors.append(np.asarray(row['embedding'], dtype=np.float32))
+    if not ids:
+        return None
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(ids), size=min(num_queries, len(ids)), replace=False)
+    queries = encode([contents[i][:500] for i in sample])
+    return ids, titles, contents, codes, np.stack(vectors), encode, queries
+
+
+def _synthetic_corpus(num_docs: int, num_queries: int, dim: int = 1024, docs_per_title: int = 20):
+    """Clustered random vectors shaped like the corpus (one title per ~20 articles)"""
+    rng = np.random.default_rng(0)
+    num_titles = max(num_docs // docs_per_title, 1)
+    title_vectors = normalize(rng.standard_normal((num_titles, dim)))
+    doc_title = rng.integers(0, num_titles, num_docs)
+    vectors = normalize(title_vectors[doc_title] + 1.5 * normalize(rng.standard_normal((num_docs, dim))))
+    titles = [f"title {t}" for t in doc_title]
+    title_by_name = {f"title {t}": title_vectors[t] for t in range(num_titles)}
+    sample = rng.choice(num_docs, size=min(num_queries, num_docs), replace=False)
+    queries = vectors[sample] + 2.0 * normalize(rng.standard_normal((len(sample), dim)))
+    codes = [f"code {t % 10}" for t in doc_title]
+    ids = list(range(1, num_docs + 1))
+
+    def encode(texts: List[str]) -> np.ndarray:
+        return np.stack([title_by_name[t] for t in texts])
+
+    return ids, titles, [""] * num_docs, codes, vectors, encode, queries
+
+
+def _benchmark(mode: str, k: int, num_queries: int, top_m: int, code: Optional[str] = None,
+               synthetic: Optional[int] = None) -> None:
+    corpus = _synthetic_corpus(synthetic, num_queries) if synthetic else _load_benchmark_corpus(num_queries)
+    if corpus is None:
+        print("No documents found")
+        return
+    ids, titles, contents, codes, vectors, encode, queries = corpus
+    content_matrix = normalize(vectors)
+    unique_titles = list(dict.fromkeys(titles))
+    title_matrix = normalize(encode(unique_titles))
+    title_position = {t: i for i, t in enumerate(unique_titles)}
+    title_rows = np.array([title_position[t] for t in titles])
+
+    index = QuantizedIndex(mode)
+    index.add(ids, titles, content_matrix, encode)
+    by_id = {doc_id: (titles[i], contents[i], content_matrix[i]) for i, doc_id in enumerate(ids)}
+    queries = normalize(queries)
+
+    hits, exact_time, index_time = 0, 0.0, 0.0
+    for query_vec in queries:
+        started = time.perf_counter()
+        exact = CONTENT_WEIGHT * (content_matrix @ query_vec) + TITLE_WEIGHT * (title_matrix @ query_vec)[title_rows]
+        expected = {ids[i] for i in np.argsort(-exact)[:k]}
+        exact_time += time.perf_counter() - started
+
+        started = time.perf_counter()
+        found = index.search_rescored(query_vec, k, top_m, lambda wanted: {i: by_id[i] for i in wanted})
+        index_time += time.perf_counter() - started
+        hits += len(expected & {doc_id for doc_id, _, _, _ in found})
+
+    stats = index.memory_stats()
+    print(f"documents:             {stats['documents']} ({stats['unique_titles']} unique titles)")
+    print(f"bytes/doc ({mode}):     {stats['bytes_per_document']}")
+    print(f"bytes/doc (float32):   {stats['float32_bytes_per_document']}")
+    print(f"recall@{k} (M={top_m}):  {hits / (len(queries) * k):.4f}")
+    print(f"exact search:          {1000 * exact_time / len(queries):.2f} ms/query")
+    print(f"quantized + rescore:   {1000 * index_time / len(queries):.2f} ms/query")
+
+    if code is not None:
+        allowed = np.array([doc_id for doc_id, c in zip(ids, codes) if c == code], dtype=np.int64)
+        started = time.perf_counter()
+        for query_vec in queries:
+            index.search_rescored(query_vec, k, top_m, lambda wanted: {i: by_id[i] for i in wanted}, allowed_ids=allowed)
+        filtered_time = time.perf_counter() - started
+        print(f"filtered ({code}, {len(allowed)} docs): {1000 * filtered_time / len(queries):.2f} ms/query")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantized index memory/recall benchmark")
+    parser.add_argument("--mode", choices=INDEX_MODES, default="int8")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=50)
+    parser.add_argument("--code", help="also time searches restricted to this code_id")
+    parser.add_argument("--synthetic", type=int, metavar="N",
+                        help="use N clustered random documents instead of the database")
+    args = parser.parse_args()
+    _benchmark(args.mode, args.k, args.queries, args.candidates, args.code, args.synthetic)